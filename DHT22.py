@@ -4,9 +4,28 @@
 
 import time
 import atexit
+import threading
+from collections import namedtuple
 
 import pigpio
 
+Reading = namedtuple('Reading', 'timestamp temperature humidity')
+
+class ReadError(Exception):
+   """A reading was triggered but no valid message was received."""
+
+class ChecksumError(ReadError):
+   """All 40 bits arrived but the checksum did not match."""
+
+class ShortMessageError(ReadError):
+   """The sensor stopped sending part way through the message."""
+
+class MissingMessageError(ReadError):
+   """The sensor did not respond at all."""
+
+class ReadTimeout(ReadError):
+   """The reading did not complete in time, e.g. while power cycling."""
+
 class sensor:
    """
    A class to read relative humidity and temperature from the
@@ -32,6 +51,9 @@ class sensor:
    gpio ------------+
    """
 
+   # Shortest safe time between readings in seconds, see __init__.
+   MIN_INTERVAL = 3
+
    def __init__(self, pi, gpio, LED=None, power=None):
       """
       Instantiate with the Pi and gpio to which the DHT22 output
@@ -77,6 +99,11 @@ class sensor:
 
       self.tov = None
 
+      # Set from _cb once a triggered reading completes or fails;
+      # result is then a Reading or a ReadError.
+      self.done = threading.Event()
+      self.result = None
+
       self.high_tick = 0
       self.bit = 40
 
@@ -137,10 +164,14 @@ class sensor:
                   if self.LED is not None:
                      self.pi.write(self.LED, 0)
 
+                  self._complete(Reading(self.tov, self.temp, self.rhum))
+
                else:
 
                   self.bad_CS += 1
 
+                  self._complete(ChecksumError("bad checksum"))
+
          elif self.bit >=24: # in temp low byte
             self.tL = (self.tL<<1) + val
 
@@ -172,6 +203,7 @@ class sensor:
          self.pi.set_watchdog(self.gpio, 0)
          if self.bit < 8:       # Too few data bits received.
             self.bad_MM += 1    # Bump missing message count.
+            self._complete(MissingMessageError("no response from sensor"))
             self.no_response += 1
             if self.no_response > self.MAX_NO_RESPONSE:
                self.no_response = 0
@@ -185,11 +217,34 @@ class sensor:
                   self.powered = True
          elif self.bit < 39:    # Short message receieved.
             self.bad_SM += 1    # Bump short message count.
+            self._complete(ShortMessageError("short message, {} bits".format(max(self.bit, 0))))
             self.no_response = 0
 
          else:                  # Full message received.
             self.no_response = 0
 
+   def _complete(self, result):
+      self.result = result
+      self.done.set()
+
+   def read(self, timeout=0.5):
+      """
+      Trigger a reading and wait up to timeout seconds for it.
+
+      Return a Reading of the time it was taken, the temperature in
+      Celsius and the relative humidity.  The reading is always a new
+      one, never the last good value.  Raise a ReadError subclass if
+      the sensor did not deliver a valid message.
+      """
+      self.done.clear()
+      self.result = None
+      self.trigger()
+      if not self.done.wait(timeout):
+         raise ReadTimeout("no reading within {} seconds".format(timeout))
+      if isinstance(self.result, ReadError):
+         raise self.result
+      return self.result
+
    def temperature(self):
       """Return current temperature."""
       return self.temp
@@ -264,14 +319,14 @@ if __name__ == "__main__":
 
       r += 1
 
-      s.trigger()
-
-      time.sleep(0.2)
-
-      print("{} {} {} {:3.2f} {} {} {} {}".format(
-         r, s.humidity(), s.temperature(), s.staleness(),
-         s.bad_checksum(), s.short_message(), s.missing_message(),
-         s.sensor_resets()))
+      try:
+         reading = s.read()
+         print("{} {} {} {} {} {} {}".format(
+            r, reading.humidity, reading.temperature,
+            s.bad_checksum(), s.short_message(), s.missing_message(),
+            s.sensor_resets()))
+      except DHT22.ReadError as e:
+         print("{} {}: {}".format(r, type(e).__name__, e))
 
       next_reading += INTERVAL
 
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+
+import threading
+
+try:
+    from time import monotonic
+except ImportError:
+    from monotonic import monotonic
+
+class Actuator:
+    """
+    An on/off output on a GPIO, such as a heater relay.
+
+    The GPIO is only written when the state actually changes, and the
+    listener, if there is one, is called with (actuator, on) after each
+    change.  The state is None until it is first set.
+    """
+
+    def __init__(self, gpio, pin, name, listener=None):
+        self.gpio = gpio
+        self.pin = pin
+        self.name = name
+        self.listener = listener
+        self.on = None
+        self.onSince = None
+        self.onTime = 0.0
+        self.lock = threading.Lock()
+
+    def set(self, on):
+        """Switch on or off, returning whether that changed anything."""
+        with self.lock:
+            if on == self.on:
+                return False
+            self.gpio.write(self.pin, 1 if on else 0)
+            if on:
+                self.onSince = monotonic()
+            elif self.onSince is not None:
+                self.onTime += monotonic() - self.onSince
+                self.onSince = None
+            self.on = on
+        if self.listener is not None:
+            self.listener(self, on)
+        return True
+
+    def totalOnTime(self):
+        """Return how many seconds it has been on for in total."""
+        with self.lock:
+            if self.onSince is None:
+                return self.onTime
+            return self.onTime + monotonic() - self.onSince
+
+class Pump(Actuator):
+    """
+    An actuator that runs in timed pulses with a cooldown between them.
+
+    pulse switches the pump on and returns straight away; a timer
+    thread switches it off again when the pulse is over.  A pulse
+    asked for less than cooldown seconds after the last one started
+    is refused.
+    """
+
+    def __init__(self, gpio, pin, name, cooldown, listener=None):
+        Actuator.__init__(self, gpio, pin, name, listener)
+        self.cooldown = cooldown
+        self.lastPulse = None
+        self.timer = None
+
+    def pulse(self, seconds):
+        """Run for seconds unless still cooling down, returning whether it started."""
+        with self.lock:
+            now = monotonic()
+            if self.lastPulse is not None and now - self.lastPulse < self.cooldown:
+                return False
+            self.lastPulse = now
+            self.timer = threading.Timer(seconds, self.set, (False,))
+            self.timer.daemon = True
+        self.set(True)
+        self.timer.start()
+        return True
+
+    def cancel(self):
+        """End any pulse early and switch the pump off."""
+        with self.lock:
+            timer = self.timer
+        if timer is not None:
+            timer.cancel()
+        self.set(False)
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+
+import json
+import threading
+import time
+
+try:
+    from Queue import Queue, Full
+except ImportError:
+    from queue import Queue, Full
+
+try:
+    from time import monotonic
+except ImportError:
+    from monotonic import monotonic
+
+try:
+    from urllib2 import Request, urlopen
+except ImportError:
+    from urllib.request import Request, urlopen
+
+class FCMTransport:
+    """
+    Sends alerts to a Firebase Cloud Messaging topic.
+
+    The FCMNotification client is created on the first send and kept
+    for the life of the process, so its HTTPS session is reused.
+    """
+
+    def __init__(self, apiKey, topic='alerts'):
+        self.apiKey = apiKey
+        self.topic = topic
+        self.client = None
+
+    def send(self, message):
+        if self.client is None:
+            from pyfcm import FCMNotification
+            if self.apiKey is None:
+                raise ValueError("FCM_KEY is not set")
+            self.client = FCMNotification(api_key=self.apiKey)
+        self.client.notify_topic_subscribers(topic_name=self.topic, message_body=message)
+
+class HTTPTransport:
+    """
+    POSTs each alert as a JSON object with topic and message fields
+    to a URL, such as a local stand-in for the push service.  Any
+    response other than a 2xx counts as a failure.
+    """
+
+    def __init__(self, url, topic='alerts', timeout=10):
+        self.url = url
+        self.topic = topic
+        self.timeout = timeout
+
+    def send(self, message):
+        body = json.dumps({'topic': self.topic, 'message': message}).encode('utf-8')
+        request = Request(self.url, body, {'Content-Type': 'application/json'})
+        urlopen(request, timeout=self.timeout).close()
+
+class AlertDispatcher(threading.Thread):
+    """
+    Delivers alerts through a transport from a background thread.
+
+    send never blocks on the network.  Alerts are deduplicated by key:
+    one sent less than window seconds after the last accepted alert
+    with the same key is suppressed.  A delivery that fails is retried
+    up to retries times, waiting backoff seconds before the first
+    retry and twice as long before each one after, up to maxBackoff.
+    """
+
+    def __init__(self, transport, window=300, retries=5, backoff=2, maxBackoff=300, maxQueued=64):
+        threading.Thread.__init__(self, name='alerts')
+        self.daemon = True
+        self.transport = transport
+        self.window = window
+        self.retries = retries
+        self.backoff = backoff
+        self.maxBackoff = maxBackoff
+        self.queue = Queue(maxQueued)
+        self.lastSent = {}
+        self.lock = threading.Lock()
+        self.sent = 0
+        self.failed = 0
+        self.suppressed = 0
+        self.dropped = 0
+
+    def send(self, key, message):
+        """Queue an alert, returning False if it was a duplicate or the queue is full."""
+        with self.lock:
+            now = monotonic()
+            last = self.lastSent.get(key)
+            if last is not None and now - last < self.window:
+                self.suppressed += 1
+                return False
+            try:
+                self.queue.put_nowait(message)
+            except Full:
+                self.dropped += 1
+                return False
+            self.lastSent[key] = now
+            return True
+
+    def stop(self, timeout=2):
+        """Give queued alerts up to timeout seconds to go out, then stop."""
+        try:
+            self.queue.put(None, timeout=timeout)
+        except Full:
+            return
+        self.join(timeout)
+
+    def run(self):
+        while True:
+            message = self.queue.get()
+            if message is None:
+                break
+            self.deliver(message)
+
+    def deliver(self, message):
+        delay = self.backoff
+        for attempt in range(self.retries + 1):
+            try:
+                self.transport.send(message)
+                self.sent += 1
+                return True
+            except Exception as e:
+                print("Failed to send alert, attempt {}: {}".format(attempt + 1, e))
+            if attempt < self.retries:
+                time.sleep(delay)
+                delay = min(delay * 2, self.maxBackoff)
+        self.failed += 1
+        return False
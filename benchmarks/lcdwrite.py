@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+
+"""
+Microbenchmark for the LCD1602 driver's write path.
+
+Runs the current driver and a copy of the original bit by bit writer
+against a stub GPIO module and reports the time per character and the
+GPIO calls per character.  The stub latches a nibble on every falling
+edge of E, so the benchmark also checks that both drivers send the
+display exactly the same bytes.
+
+Usage: python benchmarks/lcdwrite.py [characters]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from lcd1602 import LCD
+
+class StubGPIO:
+    """Just enough of RPi.GPIO for the LCD driver, recording what is sent."""
+
+    BCM = 11
+    OUT = 0
+
+    def __init__(self, pin_rs=27, pin_e=22, pins_db=(25, 24, 23, 18)):
+        self.pin_rs = pin_rs
+        self.pin_e = pin_e
+        self.pins_db = pins_db
+        self.levels = {}
+        self.calls = 0
+        self.received = []
+        self.nibble = None
+
+    def setwarnings(self, flag):
+        pass
+
+    def setmode(self, mode):
+        pass
+
+    def setup(self, pin, mode):
+        self.levels[pin] = False
+
+    def cleanup(self, pins=None):
+        pass
+
+    def output(self, channels, values):
+        self.calls += 1
+        if not isinstance(channels, (list, tuple)):
+            channels, values = [channels], [values]
+        falling = False
+        for channel, value in zip(channels, values):
+            if channel == self.pin_e and self.levels[channel] and not value:
+                falling = True
+            self.levels[channel] = bool(value)
+        if falling:
+            self.latch()
+
+    def latch(self):
+        nibble = sum(self.levels[pin] << i for i, pin in enumerate(self.pins_db))
+        if self.nibble is None:
+            self.nibble = nibble
+        else:
+            self.received.append((self.levels[self.pin_rs], self.nibble << 4 | nibble))
+            self.nibble = None
+
+class LegacyLCD(LCD):
+    """The driver as it was before the lookup table and batched output."""
+
+    def write4bits(self, bits, char_mode=False, delay=None):
+        self.delayMicroseconds(1000)
+        bits = bin(bits)[2:].zfill(8)
+        self.GPIO.output(self.pin_rs, char_mode)
+        for pin in self.pins_db:
+            self.GPIO.output(pin, False)
+        for i in range(4):
+            if bits[i] == "1":
+                self.GPIO.output(self.pins_db[::-1][i], True)
+        self.pulseEnable()
+        for pin in self.pins_db:
+            self.GPIO.output(pin, False)
+        for i in range(4, 8):
+            if bits[i] == "1":
+                self.GPIO.output(self.pins_db[::-1][i - 4], True)
+        self.pulseEnable()
+        if delay == self.DELAY_HOME:
+            self.delayMicroseconds(3000)
+
+    def pulseEnable(self):
+        self.GPIO.output(self.pin_e, False)
+        self.delayMicroseconds(1)
+        self.GPIO.output(self.pin_e, True)
+        self.delayMicroseconds(1)
+        self.GPIO.output(self.pin_e, False)
+        self.delayMicroseconds(1)
+
+def run(lcdClass, text, sleeps=True):
+    gpio = StubGPIO()
+    lcd = lcdClass(GPIO=gpio)
+    if not sleeps:
+        lcd.delayMicroseconds = lambda microseconds: None
+    gpio.calls = 0
+    del gpio.received[:]
+    start = time.time()
+    lcd.message(text)
+    elapsed = time.time() - start
+    return elapsed / len(text), float(gpio.calls) / len(text), gpio.received
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    text = "".join(chr(32 + i % 95) for i in range(count))
+
+    print("{:<28}{:>14}{:>14}".format("", "us/char", "GPIO calls"))
+    for sleeps in (True, False):
+        results = {}
+        for name, lcdClass in (("legacy", LegacyLCD), ("current", LCD)):
+            perChar, calls, received = run(lcdClass, text, sleeps)
+            results[name] = perChar
+            label = "{} ({})".format(name, "with delays" if sleeps else "GPIO only")
+            print("{:<28}{:>14.1f}{:>14.1f}".format(label, perChar * 1e6, calls))
+            if received != [(True, ord(char)) for char in text]:
+                raise SystemExit("{} driver sent the wrong bytes".format(name))
+        print("{:<28}{:>13.1f}x".format("speedup", results["legacy"] / results["current"]))
+
+if __name__ == "__main__":
+    main()
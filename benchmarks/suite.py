@@ -0,0 +1,408 @@
+#!/usr/bin/env python
+
+"""
+Benchmarks for the web API and the storage path, run against a whole
+server on simulated hardware.
+
+For each dataset a synthetic data table is generated, one sample every
+--period seconds over a day, a year or five years, in a worker process
+that imports main and builds the schema and rollups with its own
+migrations.  The databases are cached in --cache and reused by later
+runs with the same period.
+
+Each scenario then gets its own server process, started with
+SNAKE_SIMULATE on a fresh copy of the dataset, and --clients threads
+making requests over keep-alive connections for --seconds.  The
+addDataToDB scenario instead calls addDataToDB from --clients threads
+in a worker process that imports main.  Every scenario reports its
+throughput, latency percentiles and the peak resident memory of the
+process under test, and the results are written as JSON to --output
+for comparing runs between releases.
+
+Requests to the API are made as an admin user, bench with password
+bench, which is added to every generated dataset.  The server reads
+config.json as usual, so its settings are recorded with the results.
+
+Usage: python benchmarks/suite.py [--datasets day,year,5year] [--scenarios ...]
+           [--period 60] [--clients 4] [--seconds 10] [--output results.json]
+"""
+
+import argparse
+import base64
+import hashlib
+import json
+import math
+import os
+import platform
+import random
+import resource
+import shutil
+import signal
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    from httplib import HTTPConnection
+except ImportError:
+    from http.client import HTTPConnection
+
+timer = getattr(time, 'perf_counter', time.time)
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+
+DATASETS = {
+    'day': 86400,
+    'year': 365 * 86400,
+    '5year': 5 * 365 * 86400
+}
+
+USERNAME = 'bench'
+PASSWORD = 'bench'
+
+# Part of the cached file names; bump it whenever generated datasets change
+DATASET_VERSION = 2
+
+def historyPath(window, resolution):
+    # Windows end at the dataset's last sample, and the resolution is fixed, so a cached dataset
+    # gets the same queries however long ago it was generated
+    return lambda dataset: ['/api/v1/database/{}?resolution={}'.format(dataset['last'] - window, resolution)]
+
+## Scenario name -> function of the dataset returning the paths each client cycles through
+SCENARIOS = {
+    'index': lambda dataset: ['/'],
+    'history-1h-raw': historyPath(3600, 'raw'),
+    'history-12h': historyPath(12 * 3600, '1m'),
+    'history-week': historyPath(7 * 86400, '15m'),
+    'history-all': lambda dataset: ['/api/v1/database/{}?resolution=1h'.format(dataset['first'])],
+    'api': lambda dataset: [
+        '/api/v1/temperature',
+        '/api/v1/humidity',
+        '/api/v1/settings/temperaturethreshold',
+        '/api/v1/settings/humiditythreshold',
+        '/api/v1/enclosures'
+    ],
+    'addDataToDB': None
+}
+
+SCENARIO_ORDER = ['index', 'history-1h-raw', 'history-12h', 'history-week', 'history-all', 'api', 'addDataToDB']
+
+def openMain(database):
+    """Import main on simulated hardware, with its writer connection open on database and migrated."""
+    os.environ['SNAKE_SIMULATE'] = '1'
+    sys.path.insert(0, ROOT)
+    import main
+
+    if os.path.exists(os.path.join(ROOT, 'config.json')):
+        main.readConfig()
+    main.db = sqlite3.connect(database, check_same_thread=False)
+    main.conn = main.db.cursor()
+    main.migrateDatabase()
+    main.conn.execute("SELECT max(rowid) FROM data")
+    main.lastSampleId = main.conn.fetchone()[0] or 0
+    return main
+
+def generateWorker(path, span, period, seed=1):
+    """Write span seconds of samples for enclosure 0, ending now, then build the rollups from them."""
+    main = openMain(path)
+    rng = random.Random(seed)
+    # Clients send the sha256 of the password, which is what gets hashed and stored
+    main.conn.execute("INSERT INTO users VALUES (?, ?, 1)", (USERNAME, main.hashPassword(hashlib.sha256(PASSWORD.encode('utf-8')).hexdigest())))
+    end = int(time.time())
+    start = end - span
+
+    def samples():
+        for timestamp in range(start, end, period):
+            day = 2 * math.pi * (timestamp % 86400) / 86400
+            temperature = int(round(88 + 3 * math.sin(day) + rng.gauss(0, 0.7)))
+            humidity = int(round(68 + 6 * math.cos(day) + rng.gauss(0, 1.5)))
+            yield timestamp, temperature, humidity
+
+    main.conn.executemany("INSERT INTO data (timestamp, temperature, humidity, sensor) VALUES (?, ?, ?, 0)", samples())
+    main.fillRollupTables()
+    main.db.commit()
+    main.db.close()
+    # main's display and init threads would otherwise keep the worker alive
+    os._exit(0)
+
+def describe(path):
+    db = sqlite3.connect(path)
+    rows, first, last = db.execute("SELECT count(*), min(timestamp), max(timestamp) FROM data").fetchone()
+    db.close()
+    return {'rows': rows, 'first': first, 'last': last}
+
+def checkpoint(path):
+    # Fold the WAL into the database file so copying that one file copies everything
+    db = sqlite3.connect(path)
+    db.execute("PRAGMA wal_checkpoint(TRUNCATE);")
+    db.close()
+
+class Server:
+    """main.py on simulated hardware in a child process, stopped with SIGTERM."""
+
+    def __init__(self, database, port, log):
+        self.port = port
+        env = dict(os.environ, SNAKE_SIMULATE='1', SNAKE_DATABASE=database, SNAKE_PORT=str(port))
+        self.log = open(log, 'a')
+        self.process = subprocess.Popen([sys.executable, os.path.join(ROOT, 'main.py')], cwd=ROOT, env=env,
+                                        stdout=self.log, stderr=subprocess.STDOUT)
+
+    def waitReady(self, timeout=600):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self.process.poll() is not None:
+                raise SystemExit("server exited with status {}, see {}".format(self.process.returncode, self.log.name))
+            try:
+                connection = HTTPConnection('127.0.0.1', self.port, timeout=5)
+                connection.request('GET', '/')
+                connection.getresponse().read()
+                connection.close()
+                return
+            except Exception:
+                time.sleep(0.2)
+        raise SystemExit("server did not start within {} seconds".format(timeout))
+
+    def stop(self):
+        """Stop the server and return its peak resident memory in KiB."""
+        self.process.send_signal(signal.SIGTERM)
+        pid, status, usage = os.wait4(self.process.pid, 0)
+        self.process.returncode = status
+        self.log.close()
+        return maxRssKiB(usage)
+
+def maxRssKiB(usage):
+    # Linux reports ru_maxrss in KiB, macOS in bytes
+    if sys.platform == 'darwin':
+        return usage.ru_maxrss // 1024
+    return usage.ru_maxrss
+
+def prepare(name, period, cache):
+    """Return the path of the dataset, generating it if it is not cached."""
+    path = os.path.join(cache, '{}-{}s-v{}.db'.format(name, period, DATASET_VERSION))
+    if os.path.exists(path):
+        return path
+    print("Generating {} dataset, one sample every {}s".format(name, period))
+    partial = path + '.partial'
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(partial + suffix):
+            os.remove(partial + suffix)
+    start = time.time()
+    command = [sys.executable, os.path.abspath(__file__), '--generate-worker', partial, '--datasets', name, '--period', str(period)]
+    with open(os.devnull, 'w') as devnull:
+        subprocess.check_call(command, stdout=devnull)
+    print("Generated in {:.1f}s".format(time.time() - start))
+    checkpoint(partial)
+    os.rename(partial, path)
+    return path
+
+def summarize(latencies, errors, elapsed):
+    latencies.sort()
+
+    def percentile(p):
+        if len(latencies) == 0:
+            return None
+        return latencies[min(len(latencies) - 1, max(0, int(math.ceil(p / 100.0 * len(latencies))) - 1))]
+
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'seconds': elapsed,
+        'throughput': len(latencies) / elapsed,
+        'latency': {
+            'p50': percentile(50),
+            'p90': percentile(90),
+            'p99': percentile(99),
+            'max': latencies[-1] if latencies else None,
+            'mean': sum(latencies) / len(latencies) if latencies else None
+        }
+    }
+
+def runClients(clients, seconds, work):
+    """Call work(client) from clients threads for seconds; it returns a latency, or None on error."""
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = [None]
+    barrier = threading.Event()
+
+    def client(index):
+        mine = []
+        failed = 0
+        barrier.wait()
+        while timer() < deadline[0]:
+            latency = work(index)
+            if latency is None:
+                failed += 1
+            else:
+                mine.append(latency)
+        with lock:
+            latencies.extend(mine)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=client, args=(index,)) for index in range(clients)]
+    for thread in threads:
+        thread.start()
+    start = timer()
+    deadline[0] = start + seconds
+    barrier.set()
+    for thread in threads:
+        thread.join()
+    return summarize(latencies, errors[0], timer() - start)
+
+def httpScenario(paths, port, clients, seconds):
+    token = base64.b64encode('{}:{}'.format(USERNAME, PASSWORD).encode('utf-8')).decode('ascii')
+    headers = {'Authorization': 'Basic ' + token}
+    connections = [None] * clients
+    requestCounts = [0] * clients
+
+    def request(index):
+        path = paths[requestCounts[index] % len(paths)]
+        requestCounts[index] += 1
+        start = timer()
+        try:
+            if connections[index] is None:
+                connections[index] = HTTPConnection('127.0.0.1', port, timeout=60)
+            connections[index].request('GET', path, headers=headers)
+            response = connections[index].getresponse()
+            response.read()
+        except Exception:
+            if connections[index] is not None:
+                connections[index].close()
+                connections[index] = None
+            return None
+        if response.status != 200:
+            return None
+        return timer() - start
+
+    # One untimed round first, so connections are open and the credential cache is warm
+    for index in range(clients):
+        for path in paths:
+            request(index)
+    return runClients(clients, seconds, request)
+
+def storageWorker(database, clients, seconds, output):
+    """Time addDataToDB in this process, as the control loop would call it, and write the result to output."""
+    main = openMain(database)
+    rng = random.Random(1)
+
+    def add(index):
+        start = timer()
+        main.addDataToDB(rng.randint(84, 92), rng.randint(60, 75), 0)
+        return timer() - start
+
+    result = runClients(clients, seconds, add)
+    main.flushDataToDB()
+    result['maxRssKiB'] = maxRssKiB(resource.getrusage(resource.RUSAGE_SELF))
+    with open(output, 'w') as f:
+        json.dump(result, f)
+    # main's display and init threads would otherwise keep the worker alive
+    os._exit(0)
+
+def storageScenario(database, clients, seconds):
+    handle, output = tempfile.mkstemp(suffix='.json')
+    os.close(handle)
+    try:
+        command = [sys.executable, os.path.abspath(__file__), '--storage-worker', database,
+                   '--clients', str(clients), '--seconds', str(seconds), '--output', output]
+        with open(os.devnull, 'w') as devnull:
+            subprocess.check_call(command, stdout=devnull)
+        with open(output) as f:
+            return json.load(f)
+    finally:
+        os.remove(output)
+
+def runScenario(name, dataset, source, options):
+    workDir = tempfile.mkdtemp(prefix='snakebench-')
+    try:
+        database = os.path.join(workDir, 'data.db')
+        shutil.copyfile(source, database)
+        if name == 'addDataToDB':
+            return storageScenario(database, options.clients, options.seconds)
+        server = Server(database, options.port, os.path.join(options.cache, 'server.log'))
+        try:
+            server.waitReady()
+            result = httpScenario(SCENARIOS[name](dataset), options.port, options.clients, options.seconds)
+        finally:
+            maxRss = server.stop()
+        result['maxRssKiB'] = maxRss
+        return result
+    finally:
+        shutil.rmtree(workDir)
+
+def gitRevision():
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT, stderr=devnull).decode('ascii').strip()
+    except Exception:
+        return None
+
+def readServerConfig():
+    try:
+        with open(os.path.join(ROOT, 'config.json')) as f:
+            return json.load(f)
+    except IOError:
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the web API and storage paths on simulated hardware.")
+    parser.add_argument('--datasets', default='day,year,5year', help="comma separated, from {}".format(', '.join(sorted(DATASETS))))
+    parser.add_argument('--scenarios', default=','.join(SCENARIO_ORDER), help="comma separated, from {}".format(', '.join(SCENARIO_ORDER)))
+    parser.add_argument('--period', type=int, default=60, help="seconds between generated samples; the server samples every 7")
+    parser.add_argument('--clients', type=int, default=4, help="concurrent clients")
+    parser.add_argument('--seconds', type=float, default=10, help="how long each scenario runs")
+    parser.add_argument('--port', type=int, default=8099, help="port for the servers under test")
+    parser.add_argument('--cache', default=os.path.join(tempfile.gettempdir(), 'snakeserver-benchmarks'), help="where generated datasets are kept")
+    parser.add_argument('--output', default='results.json', help="where to write the results")
+    parser.add_argument('--generate-worker', metavar='DATABASE', help=argparse.SUPPRESS)
+    parser.add_argument('--storage-worker', metavar='DATABASE', help=argparse.SUPPRESS)
+    options = parser.parse_args()
+
+    if options.generate_worker:
+        generateWorker(options.generate_worker, DATASETS[options.datasets], options.period)
+        return
+    if options.storage_worker:
+        storageWorker(options.storage_worker, options.clients, options.seconds, options.output)
+        return
+
+    datasets = options.datasets.split(',')
+    scenarios = options.scenarios.split(',')
+    for name in datasets:
+        if name not in DATASETS:
+            parser.error("unknown dataset {}".format(name))
+    for name in scenarios:
+        if name not in SCENARIOS:
+            parser.error("unknown scenario {}".format(name))
+    if not os.path.isdir(options.cache):
+        os.makedirs(options.cache)
+
+    report = {
+        'started': int(time.time()),
+        'revision': gitRevision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'options': {'period': options.period, 'clients': options.clients, 'seconds': options.seconds},
+        'config': readServerConfig(),
+        'results': []
+    }
+    print("{:<8}{:<16}{:>10}{:>10}{:>10}{:>10}{:>8}{:>12}".format("dataset", "scenario", "req/s", "p50 ms", "p90 ms", "p99 ms", "errors", "maxRSS KiB"))
+    for datasetName in datasets:
+        source = prepare(datasetName, options.period, options.cache)
+        dataset = describe(source)
+        for scenario in scenarios:
+            result = runScenario(scenario, dataset, source, options)
+            result.update({'dataset': datasetName, 'rows': dataset['rows'], 'scenario': scenario, 'clients': options.clients})
+            report['results'].append(result)
+            latency = dict((key, (value or 0) * 1000) for key, value in result['latency'].items())
+            print("{:<8}{:<16}{:>10.1f}{:>10.2f}{:>10.2f}{:>10.2f}{:>8}{:>12}".format(
+                datasetName, scenario, result['throughput'], latency['p50'], latency['p90'], latency['p99'], result['errors'], result['maxRssKiB']))
+            # Written after every scenario so an interrupted run still leaves its results
+            with open(options.output, 'w') as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+                f.write("\n")
+
+if __name__ == "__main__":
+    main()
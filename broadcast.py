@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+
+import errno
+import os
+import select
+import socket
+import threading
+from json import dumps
+
+try:
+    from Queue import Queue, Empty, Full
+except ImportError:
+    from queue import Queue, Empty, Full
+
+try:
+    from time import monotonic
+except ImportError:
+    from monotonic import monotonic
+
+def _isClosed(sock):
+    """Return True if sock can no longer be passed to select."""
+    try:
+        select.select([sock], [], [], 0)
+    except ValueError:
+        return True
+    except (select.error, socket.error, OSError) as e:
+        return e.args[0] == errno.EBADF
+    return False
+
+class _Attached:
+    def __init__(self, subscriber, sock):
+        self.subscriber = subscriber
+        self.socket = sock
+        self.pending = b''
+        self.lastWrite = monotonic()
+
+class Broadcaster:
+    """
+    Fans events out to Server-Sent Events subscribers.
+
+    Each event is encoded once and the same string is handed to every
+    subscriber's queue, so publishing costs one encode plus a queue put
+    per client no matter what the clients are doing.  A subscriber
+    that falls more than backlog events behind loses its oldest ones.
+
+    A subscription is either read by the request's own thread through
+    stream, or attached to a socket the server has handed over, in
+    which case one writer thread sends to every attached client with
+    non-blocking writes.  A stalled client then costs nothing but its
+    queue.
+    """
+
+    def __init__(self, maxSubscribers=32, backlog=16, keepalive=15):
+        self.maxSubscribers = maxSubscribers
+        self.backlog = backlog
+        self.keepalive = keepalive
+        self.subscribers = []
+        self.attached = {}
+        self.lock = threading.Lock()
+        self.writer = None
+        self.wakeReader, self.wakeWriter = os.pipe()
+
+    def format(self, event, data):
+        return "event: {}\ndata: {}\n\n".format(event, dumps(data))
+
+    def publish(self, event, data):
+        message = self.format(event, data)
+        with self.lock:
+            subscribers = self.subscribers[:]
+        for subscriber in subscribers:
+            while True:
+                try:
+                    subscriber.put_nowait(message)
+                    break
+                except Full:
+                    try:
+                        subscriber.get_nowait()
+                    except Empty:
+                        pass
+        if len(self.attached) > 0:
+            os.write(self.wakeWriter, b'x')
+
+    def subscribe(self, initial=()):
+        """
+        Return a new subscription primed with the initial messages, or
+        None if there are already maxSubscribers.
+        """
+        with self.lock:
+            if len(self.subscribers) >= self.maxSubscribers:
+                return None
+            subscriber = Queue(max(self.backlog, len(initial)))
+            for message in initial:
+                subscriber.put_nowait(message)
+            self.subscribers.append(subscriber)
+            return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            if subscriber in self.subscribers:
+                self.subscribers.remove(subscriber)
+
+    def attach(self, subscriber, sock):
+        """
+        Send a subscription's messages to sock, whose response headers
+        have already been written, until the client goes away.
+        """
+        sock.setblocking(False)
+        with self.lock:
+            self.attached[sock] = _Attached(subscriber, sock)
+            if self.writer is None:
+                self.writer = threading.Thread(target=self._write, name='events')
+                self.writer.daemon = True
+                self.writer.start()
+        os.write(self.wakeWriter, b'x')
+
+    def _write(self):
+        while True:
+            try:
+                self._writeOnce()
+            except Exception as e:
+                # The writer serves every attached stream, so it must outlive any one failure
+                print("Event writer error: {}".format(e))
+
+    def _writeOnce(self):
+        with self.lock:
+            attached = list(self.attached.values())
+        sockets = [client.socket for client in attached]
+        writable = [client.socket for client in attached if client.pending]
+        # Clients that are behind wait for their socket to drain; the rest are due a keepalive
+        caughtUp = [client.lastWrite for client in attached if not client.pending]
+        timeout = None
+        if len(caughtUp) > 0:
+            timeout = max(0, min(caughtUp) + self.keepalive - monotonic())
+        try:
+            readable = select.select([self.wakeReader] + sockets, writable, [], timeout)[0]
+        except (select.error, socket.error, OSError, ValueError) as e:
+            if not isinstance(e, ValueError) and e.args[0] == errno.EINTR:
+                return
+            # Something closed one of the sockets under us, and select rejects the whole set for it
+            for client in attached:
+                if _isClosed(client.socket):
+                    self._detach(client)
+            return
+        if self.wakeReader in readable:
+            try:
+                os.read(self.wakeReader, 512)
+            except OSError as e:
+                if e.errno != errno.EINTR:
+                    raise
+        # Look again, since the wakeup may have been a new client attaching
+        with self.lock:
+            attached = list(self.attached.values())
+        for client in attached:
+            # Clients never send anything on a stream, so a readable socket has been closed
+            if client.socket in readable or not self._flush(client):
+                self._detach(client)
+
+    def _flush(self, client):
+        """Send what the client can take without blocking; return False once it has gone away."""
+        while True:
+            if not client.pending:
+                try:
+                    client.pending = client.subscriber.get_nowait().encode('utf-8')
+                except Empty:
+                    if monotonic() - client.lastWrite < self.keepalive:
+                        return True
+                    client.pending = b": keepalive\n\n"
+            try:
+                sent = client.socket.send(client.pending)
+            except socket.error as e:
+                return e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK)
+            client.pending = client.pending[sent:]
+            client.lastWrite = monotonic()
+
+    def _detach(self, client):
+        with self.lock:
+            self.attached.pop(client.socket, None)
+        self.unsubscribe(client.subscriber)
+        try:
+            client.socket.close()
+        except socket.error:
+            pass
+
+    def stream(self, subscriber, keepalive=15):
+        """
+        Yield a subscription's messages for a streaming response, with
+        a comment every keepalive seconds so dead clients are noticed.
+        """
+        try:
+            while True:
+                try:
+                    yield subscriber.get(timeout=keepalive)
+                except Empty:
+                    yield ": keepalive\n\n"
+        finally:
+            self.unsubscribe(subscriber)
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+
+"""
+Compact columnar encoding for history downloads.
+
+A payload is a fixed 21 byte header followed by three packed columns.
+Everything is little-endian.
+
+    offset  size  field
+    0       4     magic, the bytes "SNKC"
+    4       1     format version, currently 1
+    5       1     scale, values are stored multiplied by this
+    6       4     count, the number of samples (unsigned)
+    10      8     start, the first timestamp in unix seconds (signed)
+    18      3     typecodes of the time, temperature and humidity columns
+
+The typecodes are Python array module codes, one of b B h H i I, and
+the narrowest code that holds every value in the column is used.  The
+time column stores the difference from the previous timestamp, so its
+first entry is always 0.  Each column is count entries long and they
+follow the header in the order time, temperature, humidity.
+
+Raw samples are whole numbers and use a scale of 1.  Rollup averages
+carry one decimal place and use a scale of 10.
+
+The server may deflate the whole payload, and says so with the usual
+Content-Encoding header.
+"""
+
+import struct
+import sys
+from array import array
+
+MAGIC = b"SNKC"
+VERSION = 1
+HEADER = struct.Struct("<4sBBIq3s")
+MIMETYPE = "application/x-snake-columns"
+
+# Narrowest first, with the range each code can hold
+TYPECODES = (
+    ("b", -2**7, 2**7 - 1),
+    ("B", 0, 2**8 - 1),
+    ("h", -2**15, 2**15 - 1),
+    ("H", 0, 2**16 - 1),
+    ("i", -2**31, 2**31 - 1),
+    ("I", 0, 2**32 - 1),
+)
+
+def _pack(values):
+    low = min(values) if len(values) > 0 else 0
+    high = max(values) if len(values) > 0 else 0
+    for typecode, minimum, maximum in TYPECODES:
+        if minimum <= low and high <= maximum:
+            column = array(typecode, values)
+            if sys.byteorder == "big":
+                column.byteswap()
+            if hasattr(column, "tobytes"):
+                return typecode, column.tobytes()
+            return typecode, column.tostring()
+    raise ValueError("column does not fit in 32 bits")
+
+def _unpack(typecode, payload, offset, count):
+    column = array(typecode)
+    end = offset + column.itemsize * count
+    if hasattr(column, "frombytes"):
+        column.frombytes(payload[offset:end])
+    else:
+        column.fromstring(payload[offset:end])
+    if sys.byteorder == "big":
+        column.byteswap()
+    return column.tolist(), end
+
+def encode(times, temperatures, humidities, scale=1):
+    """Encode three equal length columns into a payload."""
+    count = len(times)
+    start = times[0] if count > 0 else 0
+    deltas = [times[i] - times[i - 1] if i > 0 else 0 for i in range(count)]
+    typecodes = b""
+    body = []
+    for values in (deltas,
+                   [int(round(v * scale)) for v in temperatures],
+                   [int(round(v * scale)) for v in humidities]):
+        typecode, packed = _pack(values)
+        typecodes += typecode.encode("ascii")
+        body.append(packed)
+    header = HEADER.pack(MAGIC, VERSION, scale, count, start, typecodes)
+    return header + b"".join(body)
+
+def decode(payload):
+    """Decode a payload back into (times, temperatures, humidities)."""
+    magic, version, scale, count, start, typecodes = HEADER.unpack_from(payload)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("not a version {} columnar payload".format(VERSION))
+    typecodes = str(typecodes.decode("ascii"))
+    offset = HEADER.size
+    deltas, offset = _unpack(typecodes[0], payload, offset, count)
+    temperatures, offset = _unpack(typecodes[1], payload, offset, count)
+    humidities, offset = _unpack(typecodes[2], payload, offset, count)
+    times = []
+    timestamp = start
+    for delta in deltas:
+        timestamp += delta
+        times.append(timestamp)
+    if scale != 1:
+        temperatures = [v / float(scale) for v in temperatures]
+        humidities = [v / float(scale) for v in humidities]
+    return times, temperatures, humidities
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+try:
+    from Queue import Queue, Empty
+except ImportError:
+    from queue import Queue, Empty
+
+class PoolTimeout(Exception):
+    """No connection was returned to the pool within its timeout."""
+
+class ReaderPool:
+    """
+    A bounded pool of read-only SQLite connections.
+
+    Connections are opened lazily, up to size of them, and handed to
+    one thread at a time.  When every connection is checked out the
+    next reader waits up to timeout seconds for one to be returned and
+    then raises PoolTimeout, so a burst of requests can neither open an
+    unbounded number of file handles nor queue up behind them forever.
+
+    The database should be in WAL mode so readers never block, and
+    are never blocked by, the single writer connection.
+    """
+
+    def __init__(self, path, size=3, timeout=5):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self.opened = 0
+        self.idle = Queue()
+        self.lock = threading.Lock()
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, check_same_thread=False)
+        db.execute("PRAGMA query_only=ON;")
+        db.execute("PRAGMA cache_size=-2000;")
+        return db
+
+    def _acquire(self):
+        with self.lock:
+            if self.idle.empty() and self.opened < self.size:
+                self.opened += 1
+                return self._connect()
+        try:
+            return self.idle.get(timeout=self.timeout)
+        except Empty:
+            raise PoolTimeout("no database connection free within {} seconds".format(self.timeout))
+
+    @contextmanager
+    def reader(self):
+        """Check out a connection and yield a cursor on it."""
+        db = self._acquire()
+        try:
+            yield db.cursor()
+        finally:
+            self.idle.put(db)
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+
+import threading
+import time
+
+class DisplayWorker(threading.Thread):
+    """
+    A thread that owns the LCD and keeps it showing the latest state.
+
+    Other threads call showStatus, showReadings and setAlert, which
+    only record the desired state and wake the worker, so they never
+    wait on the display.  Updates that arrive while a frame is being
+    drawn are coalesced and only the newest state is drawn next.
+
+    While an alert is set the worker blinks "!!" in the bottom right
+    corner every blinkInterval seconds by itself.
+
+    If onRender is set it is called with the seconds each frame took
+    to draw.
+    """
+
+    def __init__(self, lcdFactory, blinkInterval=3):
+        threading.Thread.__init__(self, name='display')
+        self.daemon = True
+        self.lcdFactory = lcdFactory
+        self.blinkInterval = blinkInterval
+        self.state = {'status': None, 'readings': None, 'alert': False}
+        self.dirty = False
+        self.stopping = False
+        self.changed = threading.Condition()
+        self.onRender = None
+
+    def showStatus(self, lines):
+        """Show a status message until the next readings arrive."""
+        self._update(status=list(lines))
+
+    def showReadings(self, temperature, humidity):
+        self._update(status=None, readings=(temperature, humidity))
+
+    def setAlert(self, alert):
+        self._update(alert=alert)
+
+    def stop(self, timeout=2):
+        """Clear the display, release its GPIOs and wait for the worker to finish."""
+        with self.changed:
+            self.stopping = True
+            self.changed.notify()
+        self.join(timeout)
+
+    def _update(self, **changes):
+        with self.changed:
+            self.state.update(changes)
+            self.dirty = True
+            self.changed.notify()
+
+    def frame(self, state, blinkOn):
+        if state['status'] is not None:
+            return state['status']
+        if state['readings'] is None:
+            return []
+        temperature, humidity = state['readings']
+        lines = ["Temperature: {}\337F".format(temperature), "Humidity: {}%".format(humidity)]
+        if blinkOn:
+            lines[1] = lines[1][:14].ljust(14) + "!!"
+        return lines
+
+    def run(self):
+        lcd = self.lcdFactory()
+        blinkOn = False
+        nextBlink = 0
+        while True:
+            with self.changed:
+                while not self.dirty and not self.stopping:
+                    if self.state['alert']:
+                        timeout = nextBlink - time.time()
+                        if timeout <= 0:
+                            break
+                        self.changed.wait(timeout)
+                    else:
+                        self.changed.wait()
+                if self.stopping:
+                    break
+                state = dict(self.state)
+                self.dirty = False
+            if not state['alert']:
+                blinkOn = False
+            elif time.time() >= nextBlink:
+                blinkOn = not blinkOn
+                nextBlink = time.time() + self.blinkInterval
+            start = time.time()
+            lcd.render(self.frame(state, blinkOn))
+            if self.onRender is not None:
+                self.onRender(time.time() - start)
+        lcd.clear()
+        lcd.destroy()
@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+
+import time
+
+class Enclosure:
+    """
+    One enclosure: its entry from the enclosures list in config.json,
+    its sensor, heater and pump, its recent samples and its latest
+    readings and alert state.
+
+    Thresholds and other settings missing from the entry fall back to
+    the top level of the config, so a single set of thresholds can
+    still cover every enclosure.
+    """
+
+    def __init__(self, settings, defaults, sensor, recentSamples):
+        self.settings = settings
+        self.defaults = defaults
+        self.id = settings['id']
+        self.name = settings.get('name', 'Enclosure {}'.format(self.id))
+        self.sensor = sensor
+        self.recentSamples = recentSamples
+        self.lastTemperature = 0
+        self.lastHumidity = 0
+        self.lastSampleTime = int(time.time())
+        self.alertActive = False
+        # actuators.Actuator and actuators.Pump, set up once the enclosure exists to report to
+        self.heater = None
+        self.pump = None
+
+    def setting(self, key):
+        return self.settings.get(key, self.defaults[key])
+
+    def state(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'time': self.lastSampleTime,
+            'temperature': self.lastTemperature,
+            'humidity': self.lastHumidity,
+            'heat': self.heater.on,
+            'pump': bool(self.pump.on),
+            'alert': self.alertActive
+        }
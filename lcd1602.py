@@ -45,33 +45,56 @@ class LCD:
 	LCD_5x10DOTS 		= 0x04
 	LCD_5x8DOTS 		= 0x00
 
-	def __init__(self, pin_rs=27, pin_e=22, pins_db=[25, 24, 23, 18], GPIO = None):
+	# how long each class of command takes to complete, in microseconds
+	DELAY_INIT 			= 5000	# the datasheet asks for > 4.1ms during initialization
+	DELAY_HOME 			= 2000	# clear and return home take 1.52ms
+	DELAY_COMMAND 		= 50	# everything else, including data, takes 37us
+
+	def __init__(self, pin_rs=27, pin_e=22, pins_db=[25, 24, 23, 18], GPIO = None, cols=16, rows=2):
+		# Shadow of what is on screen, kept up to date by every write so render() can diff against it
+		self.cols = cols
+		self.rows = rows
+		self.numlines = rows
+		self.shadow = [[' '] * cols for row in range(rows)]
+		self.cursorPos = [0, 0]
+
 		# Emulate the old behavior of using RPi.GPIO if we haven't been given
 		# an explicit GPIO interface to use
 		if not GPIO:
 			import RPi.GPIO as GPIO
-			self.GPIO = GPIO
-			self.pin_rs = pin_rs
-			self.pin_e = pin_e
-			self.pins_db = pins_db
+		self.GPIO = GPIO
+		self.pin_rs = pin_rs
+		self.pin_e = pin_e
+		self.pins_db = pins_db
 
-			self.used_gpio = self.pins_db[:]
-			self.used_gpio.append(pin_e)
-			self.used_gpio.append(pin_rs)
+		self.used_gpio = self.pins_db[:]
+		self.used_gpio.append(pin_e)
+		self.used_gpio.append(pin_rs)
 
-			self.GPIO.setwarnings(False)
-			self.GPIO.setmode(GPIO.BCM)
-			self.GPIO.setup(self.pin_e, GPIO.OUT)
-			self.GPIO.setup(self.pin_rs, GPIO.OUT)
+		self.GPIO.setwarnings(False)
+		self.GPIO.setmode(GPIO.BCM)
+		self.GPIO.setup(self.pin_e, GPIO.OUT)
+		self.GPIO.setup(self.pin_rs, GPIO.OUT)
 
-			for pin in self.pins_db:
-				self.GPIO.setup(pin, GPIO.OUT)
+		for pin in self.pins_db:
+			self.GPIO.setup(pin, GPIO.OUT)
+		self.GPIO.output(self.pin_e, False)
 
-		self.write4bits(0x33) # initialization
-		self.write4bits(0x32) # initialization
-		self.write4bits(0x28) # 2 line 5x7 matrix
-		self.write4bits(0x0C) # turn cursor off 0x0E to enable cursor
-		self.write4bits(0x06) # shift cursor right
+		# RS and the data pins are set together with one output call per nibble.
+		# nibbles[char_mode][byte] holds the (high, low) levels for those pins,
+		# with pins_db ordered D4 to D7.
+		self.pins_out = [self.pin_rs] + self.pins_db
+		self.nibbles = [[(tuple([rs] + [bool(byte >> (4 + i) & 1) for i in range(4)]),
+						  tuple([rs] + [bool(byte >> i & 1) for i in range(4)]))
+						 for byte in range(256)] for rs in (False, True)]
+
+		# At power on the controller is in 8-bit mode and runs each nibble as an instruction of its own,
+		# so the switch to 4-bit mode goes a nibble at a time with the datasheet's wait after each
+		for nibble in (0x3, 0x3, 0x3, 0x2):
+			self.writeNibble(nibble, self.DELAY_INIT)
+		self.write4bits(0x28, delay=self.DELAY_INIT) # 2 line 5x7 matrix
+		self.write4bits(0x0C, delay=self.DELAY_INIT) # turn cursor off 0x0E to enable cursor
+		self.write4bits(0x06, delay=self.DELAY_INIT) # shift cursor right
 
 		self.displaycontrol = self.LCD_DISPLAYON | self.LCD_CURSOROFF | self.LCD_BLINKOFF
 
@@ -91,12 +114,13 @@ class LCD:
 			self.currline = 0
 
 	def home(self):
-		self.write4bits(self.LCD_RETURNHOME) # set cursor position to zero
-		self.delayMicroseconds(3000) # this command takes a long time!
+		self.write4bits(self.LCD_RETURNHOME, delay=self.DELAY_HOME) # set cursor position to zero, this command takes a long time!
+		self.cursorPos = [0, 0]
 	
 	def clear(self):
-		self.write4bits(self.LCD_CLEARDISPLAY) # command to clear display
-		self.delayMicroseconds(3000)	# 3000 microsecond sleep, clearing the display takes a long time
+		self.write4bits(self.LCD_CLEARDISPLAY, delay=self.DELAY_HOME) # command to clear display, clearing the display takes a long time
+		self.shadow = [[' '] * self.cols for row in range(self.rows)]
+		self.cursorPos = [0, 0]
 
 	def setCursor(self, col, row):
 		self.row_offsets = [ 0x00, 0x40, 0x14, 0x54 ]
@@ -105,6 +129,7 @@ class LCD:
 			row = self.numlines - 1 # we count rows starting w/0
 
 		self.write4bits(self.LCD_SETDDRAMADDR | (col + self.row_offsets[row]))
+		self.cursorPos = [col, row]
 
 	def noDisplay(self): 
 		# Turn the display off (quickly)
@@ -164,43 +189,64 @@ class LCD:
 		self.displaymode &= ~self.LCD_ENTRYSHIFTINCREMENT
 		self.write4bits(self.LCD_ENTRYMODESET | self.displaymode)
 
-	def write4bits(self, bits, char_mode=False):
-		# Send command to LCD
-		self.delayMicroseconds(1000) # 1000 microsecond sleep
-		bits=bin(bits)[2:].zfill(8)
-		self.GPIO.output(self.pin_rs, char_mode)
-		for pin in self.pins_db:
-			self.GPIO.output(pin, False)
-		for i in range(4):
-			if bits[i] == "1":
-				self.GPIO.output(self.pins_db[::-1][i], True)
+	def write4bits(self, bits, char_mode=False, delay=DELAY_COMMAND):
+		# Send command to LCD, then give it delay microseconds to complete
+		high, low = self.nibbles[char_mode][bits]
+		self.GPIO.output(self.pins_out, high)
 		self.pulseEnable()
-		for pin in self.pins_db:
-			self.GPIO.output(pin, False)
-		for i in range(4,8):
-			if bits[i] == "1":
-				self.GPIO.output(self.pins_db[::-1][i-4], True)
+		self.GPIO.output(self.pins_out, low)
+		self.pulseEnable()
+		self.delayMicroseconds(delay)
+
+	def writeNibble(self, nibble, delay):
+		# Send a single command nibble on D4-D7, then give it delay microseconds to complete
+		self.GPIO.output(self.pins_out, self.nibbles[False][nibble][1])
 		self.pulseEnable()
+		self.delayMicroseconds(delay)
 
 	def delayMicroseconds(self, microseconds):
 		seconds = microseconds / float(1000000)	# divide microseconds by 1 million for seconds
 		sleep(seconds)
 
 	def pulseEnable(self):
-		self.GPIO.output(self.pin_e, False)
-		self.delayMicroseconds(1)		# 1 microsecond pause - enable pulse must be > 450ns 
+		# E is left low between pulses. The pulse must be > 450ns, which a
+		# single GPIO call already takes, so no sleep is needed around it
 		self.GPIO.output(self.pin_e, True)
-		self.delayMicroseconds(1)		# 1 microsecond pause - enable pulse must be > 450ns 
 		self.GPIO.output(self.pin_e, False)
-		self.delayMicroseconds(1)		# commands need > 37us to settle
 
 	def message(self, text):
 		# Send string to LCD. Newline wraps to second line
 		for char in text:
 			if char == '\n':
 				self.write4bits(0xC0) # next line
+				self.cursorPos = [0, 1]
 			else:
-				self.write4bits(ord(char),True)
+				self.writeChar(char)
+
+	def writeChar(self, char):
+		# Write at the cursor and track it in the shadow; assumes left to right entry mode
+		self.write4bits(ord(char),True)
+		col, row = self.cursorPos
+		if row < self.rows and col < self.cols:
+			self.shadow[row][col] = char
+		self.cursorPos = [col + 1, row]
+
+	def render(self, lines):
+		# Draw a frame of up to rows lines, only moving the cursor to and
+		# writing the cells that differ from what is already on screen
+		for row in range(self.rows):
+			text = lines[row] if row < len(lines) else ''
+			text = text[:self.cols].ljust(self.cols)
+			col = 0
+			while col < self.cols:
+				if self.shadow[row][col] == text[col]:
+					col += 1
+					continue
+				if self.cursorPos != [col, row]:
+					self.setCursor(col, row)
+				while col < self.cols and self.shadow[row][col] != text[col]:
+					self.writeChar(text[col])
+					col += 1
 	
 	def destroy(self):
 		print "clean up used_gpio"
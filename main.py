@@ -3,45 +3,51 @@
 import faulthandler
 faulthandler.enable()
 
+import os
+
+## SNAKE_SIMULATE runs everything against simulated pigpio, DHT22 and LCD hardware.
+## Simulated time runs SNAKE_TIME_SCALE times faster, and so do the sampler and pump
+timeScale = 1.0
+if os.environ.get('SNAKE_SIMULATE'):
+    import simulation
+    simulation.install()
+    timeScale = simulation.timeScale
+
+from display import DisplayWorker
 from lcd1602 import LCD
-import thread
+import threading
 import time
 
+## The display worker owns the LCD; everything else only tells it what to show
+display = DisplayWorker(LCD)
+display.start()
+finishedInit = False
+
 def initThread():
-    global finishedInit
-    global lcd
-
-    finishedInit = False
-    lcd = LCD()
-    lcd.clear()
-    lcd.message("Initializing Boa\nHome")
-    lcd.begin(0, 2)
-    lcd.setCursor(4, 1)
-    currentCharacter = ".   "
-    lcd.message(currentCharacter)
-    time.sleep(0.3)
+    dots = 1
     while not finishedInit:
-        if currentCharacter is ".   ":
-            currentCharacter = "..  "
-        elif currentCharacter is "..  ":
-            currentCharacter = "... "
-        elif currentCharacter is "... ":
-            currentCharacter = "...."
-        elif currentCharacter is "....":
-            currentCharacter = ".   "
-        lcd.setCursor(4, 1)
-        lcd.message(currentCharacter)
+        display.showStatus(["Initializing Boa", "Home" + "." * dots])
+        dots = dots % 4 + 1
         time.sleep(0.3)
 
-thread.start_new_thread(initThread,())
+## Threads are named so they can be told apart in profiles
+initializer = threading.Thread(target=initThread, name='init')
+initializer.daemon = True
+initializer.start()
 
+from collections import OrderedDict
+from contextlib import contextmanager
 from flask import Flask
+from functools import partial, wraps
 from json import dumps
-import threading
+import columnar
+import dbpool
+import metrics
+import profiler
+import tokens
 
 app = Flask(__name__)
 
-screenLock = threading.Lock()
 databaseLock = threading.Lock()
 
 config = {
@@ -52,122 +58,504 @@ config = {
     'turnOnTemperatureThreshold': 89,
     'turnOffTemperatureThreshold': 92,
     'canAnonViewWebUI': True,
-    'canAnonUsePublicAPI': False
+    'canAnonUsePublicAPI': False,
+    'writeBufferSize': 20,
+    'writeBufferSeconds': 120,
+    'databaseReaders': 3,
+    'databaseReaderTimeout': 5,
+    'recentSampleCapacity': 17280,
+    'credentialCacheSize': 32,
+    'credentialCacheSeconds': 300,
+    'tokenLifetime': 86400,
+    'passwordHashIterations': 50000,
+    'maxStreamClients': 32,
+    'serverMode': 'pool',
+    'serverHost': '0.0.0.0',
+    'serverPort': 80,
+    'serverThreads': 6,
+    'serverBacklog': 16,
+    'serverKeepAlive': 5,
+    'serverRequestTimeout': 60,
+    'samplePeriod': 7,
+    'pumpCooldown': 12000,
+    'alertWindow': 300,
+    'alertRetries': 5,
+    'alertUrl': None,
+    'enclosures': [
+        {'id': 0, 'name': 'Enclosure', 'sensorGpio': 15, 'heatGpio': 11, 'pumpGpio': 10}
+    ]
+}
+
+## Enclosures by id, in config order. Each has its own sensor, actuators and state,
+## which is published to /api/v1/stream subscribers when it changes
+enclosures = OrderedDict()
+
+## Metrics served on /metrics. Values that are already counted elsewhere are read when scraped
+registry = metrics.Registry()
+loopPeriodSeconds = registry.histogram('snake_loop_period_seconds', 'Time between the starts of consecutive control loop ticks', buckets=(1, 2, 3, 4, 5, 6, 7, 8, 10, 15, 20, 30, 60))
+loopLatenessSeconds = registry.histogram('snake_loop_lateness_seconds', 'How long after its deadline each control loop tick started', buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 2, 5))
+sensorReadSeconds = registry.histogram('snake_sensor_read_seconds', 'Time taken by getDhtData, including queueing the sample', ['enclosure'])
+databaseCommitSeconds = registry.histogram('snake_database_commit_seconds', 'Time to insert and commit a batch of buffered samples')
+databaseLockWaitSeconds = registry.histogram('snake_database_lock_wait_seconds', 'Time spent waiting for databaseLock')
+lcdRenderSeconds = registry.histogram('snake_lcd_render_seconds', 'Time to draw one frame on the LCD')
+httpRequestSeconds = registry.histogram('snake_http_request_seconds', 'Time to handle a request, up to the start of a streamed body', ['route'])
+httpRequests = registry.counter('snake_http_requests_total', 'Requests handled', ['route', 'method', 'status'])
+display.onRender = lcdRenderSeconds.observe
+
+def collectSensorErrors():
+    errors = {}
+    for enclosure in enclosures.values():
+        errors[(enclosure.id, 'bad_checksum')] = enclosure.sensor.bad_checksum()
+        errors[(enclosure.id, 'short_message')] = enclosure.sensor.short_message()
+        errors[(enclosure.id, 'missing_message')] = enclosure.sensor.missing_message()
+        errors[(enclosure.id, 'sensor_resets')] = enclosure.sensor.sensor_resets()
+    return errors
+
+def collectActuatorOnTimes():
+    onTimes = {}
+    for enclosure in enclosures.values():
+        for actuator in (enclosure.heater, enclosure.pump):
+            onTimes[(enclosure.id, actuator.name)] = actuator.totalOnTime()
+    return onTimes
+
+def collectLoopSkips():
+    return {(): sampler.skipped}
+
+def collectLoopMaxLateness():
+    return {(): sampler.maxLateness}
+
+def collectAlerts():
+    return {
+        ('sent',): alertDispatcher.sent,
+        ('failed',): alertDispatcher.failed,
+        ('suppressed',): alertDispatcher.suppressed,
+        ('dropped',): alertDispatcher.dropped
+    }
+
+registry.counter('snake_sensor_errors_total', 'DHT22 reads that failed, and sensor power cycles', ['enclosure', 'kind'], collectSensorErrors)
+registry.counter('snake_actuator_on_seconds_total', 'Total time each heater and pump has been on', ['enclosure', 'actuator'], collectActuatorOnTimes)
+registry.counter('snake_alerts_total', 'Alerts by what became of them', ['outcome'], collectAlerts)
+registry.counter('snake_loop_skipped_ticks_total', 'Control loop ticks dropped because an earlier one overran', collect=collectLoopSkips)
+registry.gauge('snake_loop_max_lateness_seconds', 'The latest any control loop tick has started after its deadline', collect=collectLoopMaxLateness)
+
+## Rollup tables kept up to date by addDataToDB: resolution -> (table, bucket width in seconds)
+rollupTables = {
+    '1m': ('data_1m', 60),
+    '15m': ('data_15m', 900),
+    '1h': ('data_1h', 3600)
 }
 
-lastHumidityTime = 0
-lastTemperatureTime = 0
-lastPumpTime = 0
+## Tokens are signed with a per-process secret, so restarting the server ends every session.
+## updateUser bumps a user's generation, which revokes the tokens already issued to them
+tokenSecret = os.urandom(32)
+tokenGenerations = {}
+
+## Started and stopped through the admin API, to see where a sluggish Pi spends its time
+stackProfiler = profiler.SamplingProfiler()
+
+## Generations behind the ETag and Last-Modified headers. Samples are keyed on lastSampleId,
+## config changes bump configGeneration, and serverStarted keeps tags from repeating across restarts
+serverStarted = int(time.time())
+configGeneration = 0
+lastConfigTime = time.time()
+
+## Samples waiting to be written to the database in one transaction by flushDataToDB.
+## Each one is given the rowid it will be stored under, so readers can tell which have been flushed
+pendingSamples = []
+lastSampleId = 0
+pendingLock = threading.Lock()
+lastFlushTime = time.time()
 
 ## Gracefully stop gpio
 def exit_handler():
-    with screenLock:
-        lcd.clear()
-        lcd.destroy()
-    sensor.cancel()
+    flushDataToDB()
+    alertDispatcher.stop()
+    display.stop()
+    for enclosure in enclosures.values():
+        enclosure.sensor.cancel()
+        enclosure.pump.cancel()
     gpio.stop()
 
-def getDhtData():
-    global lastTemperature
-    global lastHumidity
-
-    sensor.trigger()
-    time.sleep(0.2)
-    lastHumidity = int(sensor.humidity())
-    lastTemperature = int(sensor.temperature()*9.0/5.0+32.0)
-    addDataToDB(lastHumidity, lastTemperature)
-    return lastHumidity, lastTemperature
-
-def runPump(seconds):
-    global lastPumpTime
-    if lastPumpTime + 12000000 < int(round(time.time() * 1000)):
-        lastPumpTime = int(round(time.time() * 1000))
-        print("Turning on pump for {} seconds".format(seconds))
-        gpio.write(10, 1)
-        time.sleep(seconds)
-        gpio.write(10, 0)
-
-def turnOnHeat():
-    print("Turning on heat")
-    gpio.write(11, 1)
-
-def turnOffHeat():
-    print("Turning off heat")
-    gpio.write(11, 0)
+def getDhtData(enclosure):
+    with sensorReadSeconds.labels(enclosure.id).time():
+        try:
+            reading = enclosure.sensor.read()
+        except DHT22.ReadError as e:
+            print("Failed to read sensor in {}: {}".format(enclosure.name, e))
+            return None
+        enclosure.lastHumidity = int(reading.humidity)
+        enclosure.lastTemperature = int(reading.temperature*9.0/5.0+32.0)
+        enclosure.lastSampleTime = addDataToDB(enclosure.lastTemperature, enclosure.lastHumidity, enclosure.id, enclosure.recentSamples)
+        return enclosure.lastHumidity, enclosure.lastTemperature
+
+def actuatorChanged(enclosure, actuator, on):
+    # Called by the heater and pump only when they actually switch
+    print("Turning {} {} in {}".format('on' if on else 'off', actuator.name, enclosure.name))
+    events.publish(actuator.name, {'enclosure': enclosure.id, 'on': on})
 
 ## DB Utils
-def addDataToDB(temperature, humidity):
-    from datetime import datetime
+@contextmanager
+def lockDatabase():
+    # databaseLock, timing how long the writer had to wait for it
+    start = time.time()
     with databaseLock:
-        conn.execute("INSERT INTO data (timestamp, temperature, humidity) VALUES (?, ?, ?)", (int(time.mktime(datetime.now().timetuple())), temperature, humidity))
-        db.commit()
+        databaseLockWaitSeconds.observe(time.time() - start)
+        yield
+
+## Samples are stored with the id of the enclosure they came from in the sensor column
+## and appended to its recent ring, if given, before the new lastSampleId is visible
+def addDataToDB(temperature, humidity, sensor=0, recentSamples=None):
+    from datetime import datetime
+    global lastSampleId
+
+    timestamp = int(time.mktime(datetime.now().timetuple()))
+    with pendingLock:
+        # A history read that sees the new ETag must also see the sample in the ring
+        if recentSamples is not None:
+            recentSamples.append(timestamp, temperature, humidity)
+        lastSampleId += 1
+        pendingSamples.append((timestamp, temperature, humidity, lastSampleId, sensor))
+        flushDue = len(pendingSamples) >= config['writeBufferSize'] or time.time() - lastFlushTime >= config['writeBufferSeconds']
+    if flushDue:
+        flushDataToDB()
+    return timestamp
+
+def flushDataToDB():
+    global pendingSamples
+    global lastFlushTime
+
+    with lockDatabase():
+        with pendingLock:
+            samples = pendingSamples[:]
+            lastFlushTime = time.time()
+        if len(samples) == 0:
+            return
+        with databaseCommitSeconds.time():
+            conn.executemany("INSERT INTO data (timestamp, temperature, humidity, rowid, sensor) VALUES (?, ?, ?, ?, ?)", samples)
+            for timestamp, temperature, humidity, sampleId, sensor in samples:
+                updateRollups(sensor, timestamp, temperature, humidity)
+            db.commit()
+        # Only drop the samples once they are committed, so readers always find them somewhere
+        with pendingLock:
+            del pendingSamples[:len(samples)]
+
+def updateRollups(sensor, timestamp, temperature, humidity):
+    for table, width in rollupTables.values():
+        bucket = timestamp - timestamp % width
+        conn.execute("INSERT OR IGNORE INTO {} (sensor, timestamp, count, temperature_min, temperature_max, temperature_sum, humidity_min, humidity_max, humidity_sum) VALUES (?, ?, 0, ?, ?, 0, ?, ?, 0)".format(table), (sensor, bucket, temperature, temperature, humidity, humidity))
+        conn.execute("UPDATE {} SET count = count + 1, temperature_min = min(temperature_min, ?), temperature_max = max(temperature_max, ?), temperature_sum = temperature_sum + ?, humidity_min = min(humidity_min, ?), humidity_max = max(humidity_max, ?), humidity_sum = humidity_sum + ? WHERE sensor = ? AND timestamp = ?".format(table), (temperature, temperature, temperature, humidity, humidity, humidity, sensor, bucket))
+
+def createRollupTables():
+    # Created empty; swapSampleColumns fills them from the raw data once it is in its final shape
+    for table, width in rollupTables.values():
+        conn.execute("CREATE TABLE IF NOT EXISTS {} (timestamp int PRIMARY KEY, count int, temperature_min int, temperature_max int, temperature_sum int, humidity_min int, humidity_max int, humidity_sum int);".format(table))
+
+def loadRecentSamples(enclosure):
+    conn.execute("SELECT timestamp, temperature, humidity FROM data WHERE sensor = ? ORDER BY timestamp DESC LIMIT ?", (enclosure.id, enclosure.recentSamples.capacity))
+    for row in reversed(conn.fetchall()):
+        enclosure.recentSamples.append(row[0], row[1], row[2])
+
+def createBaseTables():
+    conn.execute("CREATE TABLE IF NOT EXISTS users (username text, password text, admin int);")
+    conn.execute("CREATE TABLE IF NOT EXISTS data (timestamp int, temperature int, humidity int);")
+
+def createDataIndex():
+    conn.execute("CREATE INDEX IF NOT EXISTS data_timestamp ON data (timestamp);")
+
+def upgradePasswordHashes():
+    # Existing rows hold a bare sha256. Clients keep sending that digest, so it can be wrapped in place
+    conn.execute("SELECT username, password FROM users")
+    for username, password in conn.fetchall():
+        if not password.startswith('pbkdf2_sha256$'):
+            conn.execute("UPDATE users SET password=? WHERE username = ?", (hashPassword(password), username))
+
+def createUsernameIndex():
+    # updateUser changed every row with a matching name, so any duplicates are identical; keep one
+    conn.execute("DELETE FROM users WHERE rowid NOT IN (SELECT max(rowid) FROM users GROUP BY username);")
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS users_username ON users (username);")
+
+def addSensorColumn():
+    # Everything recorded before there could be several enclosures came from the first one, id 0
+    conn.execute("ALTER TABLE data ADD COLUMN sensor int NOT NULL DEFAULT 0;")
+    conn.execute("CREATE INDEX IF NOT EXISTS data_sensor_timestamp ON data (sensor, timestamp);")
+    conn.execute("DROP INDEX IF EXISTS data_timestamp;")
+
+def recreateRollupTables():
+    # Rollups are kept per sensor, which changes their primary key. swapSampleColumns fills them again
+    for table, width in rollupTables.values():
+        conn.execute("DROP TABLE IF EXISTS {};".format(table))
+        conn.execute("CREATE TABLE {} (sensor int, timestamp int, count int, temperature_min int, temperature_max int, temperature_sum int, humidity_min int, humidity_max int, humidity_sum int, PRIMARY KEY (sensor, timestamp));".format(table))
+
+def fillRollupTables():
+    # Rebuild every rollup bucket from the raw data
+    for table, width in rollupTables.values():
+        conn.execute("DELETE FROM {};".format(table))
+        conn.execute("INSERT INTO {0} SELECT sensor, timestamp - timestamp % {1}, count(*), min(temperature), max(temperature), sum(temperature), min(humidity), max(humidity), sum(humidity) FROM data GROUP BY sensor, timestamp - timestamp % {1}".format(table, width))
+
+def swapSampleColumns():
+    # Samples used to be stored with humidity in the temperature column and temperature in the humidity
+    # column. SQLite evaluates every SET against the old row, so one UPDATE swaps them back
+    conn.execute("UPDATE data SET temperature = humidity, humidity = temperature;")
+    # The rollups are only aggregated here, from the corrected data, so an upgrade reads data once
+    fillRollupTables()
+
+## Schema migrations, applied in order. PRAGMA user_version records how many have run
+migrations = [
+    createBaseTables,
+    createRollupTables,
+    createDataIndex,
+    createUsernameIndex,
+    upgradePasswordHashes,
+    addSensorColumn,
+    recreateRollupTables,
+    swapSampleColumns
+]
+
+def migrateDatabase():
+    # WAL lets readers run alongside the writer, and NORMAL sync only fsyncs at checkpoints
+    conn.execute("PRAGMA journal_mode=WAL;")
+    conn.execute("PRAGMA synchronous=NORMAL;")
+    conn.execute("PRAGMA cache_size=-8000;")
+    conn.execute("PRAGMA user_version;")
+    version = conn.fetchone()[0]
+    for target, migration in enumerate(migrations, 1):
+        if version < target:
+            print("Migrating database to schema version {}".format(target))
+            migration()
+            conn.execute("PRAGMA user_version = {};".format(target))
+            db.commit()
 
 def addUserToDB(username, password, admin=False):
-    with databaseLock:
-        conn.execute("INSERT INTO users (username, password, admin) VALUES (?, ?, ?)", (username, sha256(password), int(admin)))
+    with lockDatabase():
+        conn.execute("INSERT INTO users (username, password, admin) VALUES (?, ?, ?)", (username, hashPassword(sha256(password)), int(admin)))
         db.commit()
+    credentialCache.pop(username)
 
 def updateUser(username, password, admin=False):
-    with databaseLock:
-        conn.execute("UPDATE users SET password=?, admin=? WHERE username = ?", (sha256(password), int(admin), username))
+    with lockDatabase():
+        conn.execute("UPDATE users SET password=?, admin=? WHERE username = ?", (hashPassword(sha256(password)), int(admin), username))
         db.commit()
+    credentialCache.pop(username)
+    tokenGenerations[username] = tokenGenerations.get(username, 0) + 1
 
-def getDataFromDB(since, useJson=True):
-    with databaseLock:
-        conn.execute("SELECT * FROM data WHERE timestamp > ?", (since,))
-        dbData = conn.fetchall()
-        if useJson:
-            if len(dbData) == 0:
-                return dumps([]), dumps([]), dumps([])
-            temperaturearray=dumps([i[2] for i in dbData])
-            humidityarray=dumps([i[1] for i in dbData])
-            timearray=dumps([i[0] for i in dbData])
-            return temperaturearray, humidityarray, timearray
-        else:
-            if len(dbData) == 0:
-                return [], [], []
-            temperaturearray=[i[2] for i in dbData]
-            humidityarray=[i[1] for i in dbData]
-            timearray=[i[0] for i in dbData]
-            return temperaturearray, humidityarray, timearray
+def pickResolution(since):
+    # Keep every chart at roughly 720 points or fewer, whatever the window
+    window = int(time.time()) - since
+    if window <= 3600:
+        return 'raw'
+    elif window <= 12 * 3600:
+        return '1m'
+    elif window <= 180 * 3600:
+        return '15m'
+    else:
+        return '1h'
 
+def getDataFromDB(since, useJson=True, resolution=None, enclosure=None):
+    if resolution is None:
+        resolution = pickResolution(since)
+    if enclosure is None:
+        enclosure = list(enclosures.values())[0]
+    # Recent raw windows are answered from memory without touching SQLite
+    if resolution == 'raw' and enclosure.recentSamples.covers(since):
+        timearray, temperaturearray, humidityarray = enclosure.recentSamples.since(since)
+    else:
+        dbData = list(iterDataFromDB(since, resolution, enclosure.id))
+        temperaturearray=[i[1] for i in dbData]
+        humidityarray=[i[2] for i in dbData]
+        timearray=[i[0] for i in dbData]
     if useJson:
-        return dumps([]), dumps([]), dumps([])
+        return dumps(temperaturearray), dumps(humidityarray), dumps(timearray)
+    else:
+        return temperaturearray, humidityarray, timearray
+
+def iterDataFromDB(since, resolution, sensor=0, chunkSize=500):
+    # Yields (timestamp, temperature, humidity) rows for one sensor, oldest first, a page at a time.
+    # Each page is its own query on a pooled connection that goes back to the pool before the page
+    # is yielded, so a client reading an export slowly never holds one. Pages continue from the last
+    # row seen; raw rows can share a timestamp, so their position also includes the rowid.
+    # Each query returns the newest committed rowid from its snapshot too.
+    # Buffered samples with an id at or below it have already been flushed and are skipped
+    if resolution == 'raw':
+        query = "SELECT timestamp, temperature, humidity, rowid, (SELECT max(rowid) FROM data) FROM data WHERE sensor = ? AND timestamp >= ? AND NOT (timestamp = ? AND rowid <= ?) ORDER BY timestamp, rowid LIMIT ?"
+        position = (since + 1, 0)
+    else:
+        table, width = rollupTables[resolution]
+        query = "SELECT timestamp, count, temperature_sum, humidity_sum, (SELECT max(rowid) FROM data) FROM {} WHERE sensor = ? AND timestamp > ? ORDER BY timestamp LIMIT ?".format(table)
+        # Buckets are labelled by their start, so include the one that contains since
+        position = since - width
+    with pendingLock:
+        samples = pendingSamples[:]
+    flushedUntil = 0
+    # The last rollup bucket is held back in case buffered samples belong in it
+    lastBucket = []
+    while True:
+        with readerPool.reader() as cursor:
+            if resolution == 'raw':
+                cursor.execute(query, (sensor, position[0], position[0], position[1], chunkSize))
+            else:
+                cursor.execute(query, (sensor, position, chunkSize))
+            rows = cursor.fetchall()
+        if len(rows) == 0:
+            break
+        flushedUntil = rows[0][-1]
+        for row in rows:
+            if resolution == 'raw':
+                yield row[:3]
+            else:
+                for bucket in mergeRollup(lastBucket, [], width):
+                    yield bucket
+                lastBucket = [row]
+        if resolution == 'raw':
+            position = (rows[-1][0], rows[-1][3])
+        else:
+            position = rows[-1][0]
+        if len(rows) < chunkSize:
+            break
+    samples = [sample for sample in samples if sample[3] > flushedUntil and sample[4] == sensor]
+    if resolution == 'raw':
+        for sample in samples:
+            if sample[0] > since:
+                yield sample[:3]
     else:
-        return [], [], []
+        samples = [sample for sample in samples if sample[0] - sample[0] % width > since - width]
+        for bucket in mergeRollup(lastBucket, samples, width):
+            yield bucket
+
+def streamData(rows, format, chunkSize=500):
+    # Encodes rows one chunk at a time so memory use doesn't grow with the range
+    if format == 'csv':
+        yield "time,temperature,humidity\n"
+        line = "{},{},{}\n"
+    else:
+        line = '{{"time":{},"temperature":{},"humidity":{}}}\n'
+    chunk = []
+    for row in rows:
+        chunk.append(line.format(row[0], row[1], row[2]))
+        if len(chunk) >= chunkSize:
+            yield ''.join(chunk)
+            chunk = []
+    if len(chunk) > 0:
+        yield ''.join(chunk)
+
+def mergeRollup(rows, samples, width):
+    # Unflushed samples are newer than anything in the table, so they can only
+    # land in the last bucket or in new buckets after it
+    buckets = [list(row[:4]) for row in rows]
+    for sample in samples:
+        timestamp, temperature, humidity = sample[:3]
+        bucket = timestamp - timestamp % width
+        if len(buckets) > 0 and buckets[-1][0] == bucket:
+            buckets[-1][1] += 1
+            buckets[-1][2] += temperature
+            buckets[-1][3] += humidity
+        else:
+            buckets.append([bucket, 1, temperature, humidity])
+    return [(b[0], round(b[2] * 1.0 / b[1], 1), round(b[3] * 1.0 / b[1], 1)) for b in buckets]
 
 def getUserFromDB(username):
-    with databaseLock:
-        conn.execute("SELECT * FROM users WHERE username = ?", (username,))
-        dbData = conn.fetchall()
+    with readerPool.reader() as cursor:
+        cursor.execute("SELECT * FROM users WHERE username = ?", (username,))
+        dbData = cursor.fetchall()
         if len(dbData) == 0:
             return None, None, None
         return dbData[0][0], dbData[0][1], dbData[0][2]
     return None, None, None
 
-def authUser(request):
-    username = (request.authorization and request.authorization.username) or (request.headers.get('Username'))
-    password = (request.authorization and sha256(request.authorization.password)) or (request.headers.get('Password'))
+## Auth
+## password is always the hex sha256 of the user's password, which is what the headless API sends
+def checkCredentials(username, password):
+    import hashlib
+    import hmac
+
+    if username is None or password is None:
+        return False, False
+    # Cache a keyed digest of credentials that verified, so repeat requests skip the database and PBKDF2
+    presented = hmac.new(tokenSecret, password.lower().encode('utf-8'), hashlib.sha256).digest()
+    cached = credentialCache.get(username)
+    if cached is not None and hmac.compare_digest(cached[0], presented):
+        return True, cached[1]
     expectedUsername, expectedPassword, isAdmin = getUserFromDB(username)
-    if (request.authorization is not None or request.headers.get('Username') is not None) and expectedUsername is not None and expectedPassword.lower() == password.lower():
-        return True;
-    return False
+    if expectedUsername is None or not verifyPassword(password, expectedPassword):
+        return False, False
+    credentialCache.set(username, (presented, bool(isAdmin)))
+    return True, bool(isAdmin)
+
+def getCredentials(request):
+    auth = request.authorization
+    if auth is not None and auth.username is not None:
+        return auth.username, sha256(auth.password)
+    return request.headers.get('Username'), request.headers.get('Password')
+
+def getTokenClaims(headers):
+    authorization = headers.get('Authorization', '')
+    if not authorization.startswith('Bearer '):
+        return None
+    claims = tokens.verify(tokenSecret, authorization[len('Bearer '):])
+    if claims is None or claims['g'] != tokenGenerations.get(claims['u'], 0):
+        return None
+    return claims
+
+def authUser(request):
+    if getTokenClaims(request.headers) is not None:
+        return True
+    username, password = getCredentials(request)
+    verified, isAdmin = checkCredentials(username, password)
+    return verified
 
 def authHttpUserAsAdmin(auth):
-    username = auth.username
-    password = sha256(auth.password)
-    expectedUsername, expectedPassword, isAdmin = getUserFromDB(username)
-    if expectedPassword.lower() == password.lower():
-        return True and isAdmin;
-    return False
+    if auth.username is None:
+        return False
+    verified, isAdmin = checkCredentials(auth.username, sha256(auth.password))
+    return verified and isAdmin
 
 def authUserAsAdmin(headers):
-    username = headers.get('Username')
-    password = headers.get('Password')
-    expectedUsername, expectedPassword, isAdmin = getUserFromDB(username)
-    if expectedPassword.lower() == password.lower():
-        return True and isAdmin;
-    return False
+    claims = getTokenClaims(headers)
+    if claims is not None:
+        return claims['a']
+    verified, isAdmin = checkCredentials(headers.get('Username'), headers.get('Password'))
+    return verified and isAdmin
+
+## The dashboard loads its chart from the history API, so anyone who may see the web UI may read what
+## it fetches: JSON covering its 12 hour window, with an hour's slack for browsers whose clocks are off.
+## Longer ranges and exports follow the public API's rule
+anonHistorySeconds = 13 * 3600
+
+def canViewHistory(request, since):
+    if config['canAnonViewWebUI'] and getHistoryFormat(request) == 'json':
+        try:
+            if int(since) >= int(time.time()) - anonHistorySeconds:
+                return True
+        except ValueError:
+            pass
+    return config['canAnonUsePublicAPI'] or authUser(request)
+
+def getHistoryFormat(request):
+    # Streamed exports are chosen with ?format= or an Accept header
+    format = request.args.get('format')
+    if format is None:
+        format = request.accept_mimetypes.best_match(['application/json', 'application/x-ndjson', 'text/csv', columnar.MIMETYPE])
+        format = {'application/x-ndjson': 'ndjson', 'text/csv': 'csv', columnar.MIMETYPE: 'columns'}.get(format, 'json')
+    return format
+
+def getEnclosure(request):
+    from flask import abort
+
+    # Requests without ?enclosure= get the first enclosure, as they did when there was only one
+    enclosureId = request.values.get('enclosure')
+    if enclosureId is None:
+        return list(enclosures.values())[0]
+    try:
+        return enclosures[int(enclosureId)]
+    except (KeyError, ValueError):
+        abort(404)
+
+def getThresholdSettings(request):
+    # Without ?enclosure= these are the shared thresholds at the top level of the config.
+    # With it they are the enclosure's own, which fall back to the shared ones
+    if request.values.get('enclosure') is None:
+        return config, config.get
+    enclosure = getEnclosure(request)
+    return enclosure.settings, enclosure.setting
 
 def httpAuth():
     from flask import Response
@@ -176,91 +564,285 @@ def httpAuth():
         'You have to login with proper credentials', 401,
         {'WWW-Authenticate': 'Basic realm="Login Required"'})
 
+def conditional(kind, vary=False, history=False):
+    # Answers a matching If-None-Match, or If-Modified-Since for config, with 304 before the handler runs.
+    # kind is 'sample' or 'config', whichever change makes the response body different,
+    # and history selects the dashboard's access rule instead of the public API's
+    def decorator(handler):
+        @wraps(handler)
+        def wrapper(*args, **kwargs):
+            from calendar import timegm
+            from flask import make_response, request, Response
+            from zlib import crc32
+
+            if kind == 'config':
+                generation, modified = configGeneration, lastConfigTime
+            else:
+                # Several enclosures can sample within a second, which Last-Modified can't tell apart
+                generation, modified = lastSampleId, None
+            etag = '{}-{}-{}'.format(kind, serverStarted, generation)
+            if vary:
+                # The same URL has several representations, so they need distinct tags
+                etag += '-{:x}'.format(crc32((request.headers.get('Accept', '') + request.headers.get('Accept-Encoding', '')).encode('utf-8')) & 0xffffffff)
+            if request.method != 'GET':
+                return handler(*args, **kwargs)
+            if request.if_none_match:
+                notModified = request.if_none_match.contains(etag)
+            else:
+                notModified = modified is not None and request.if_modified_since is not None and timegm(request.if_modified_since.utctimetuple()) >= int(modified)
+            if history:
+                allowed = notModified and canViewHistory(request, kwargs['since'])
+            else:
+                allowed = notModified and (config['canAnonUsePublicAPI'] or authUser(request))
+            if allowed:
+                response = Response(status=304)
+            else:
+                response = make_response(handler(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            if modified is not None:
+                response.last_modified = int(modified)
+            if vary:
+                response.vary.update(('Accept', 'Accept-Encoding'))
+            return response
+        return wrapper
+    return decorator
+
 ## API Calls
+@app.errorhandler(dbpool.PoolTimeout)
+def readersBusy(e):
+    from flask import Response
+    print("Refusing request: {}".format(e))
+    return Response('Server busy\n', 503, {'Retry-After': '1'}, mimetype='text/plain')
+
+@app.before_request
+def startRequestTimer():
+    from flask import g
+    g.requestStart = time.time()
+
+@app.after_request
+def recordRequest(response):
+    from flask import g, request
+
+    # Label by route pattern rather than path, so /api/v1/database/<since> is one series
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    httpRequestSeconds.labels(route).observe(time.time() - g.requestStart)
+    httpRequests.labels(route, request.method, response.status_code).inc()
+    return response
+
+@app.route("/metrics")
+def serveMetrics():
+    from flask import request, Response
+
+    if config['canAnonUsePublicAPI'] or authUser(request):
+        return Response(registry.render(), content_type=metrics.Registry.MIMETYPE)
+    else:
+        return httpAuth()
+
+@app.route("/api/v1/login", methods=['POST'])
+def login():
+    from flask import jsonify, request
+
+    username, password = getCredentials(request)
+    verified, isAdmin = checkCredentials(username, password)
+    if verified:
+        claims = {'u': username, 'a': isAdmin, 'g': tokenGenerations.get(username, 0)}
+        return jsonify(token=tokens.issue(tokenSecret, claims, config['tokenLifetime']), expires=int(time.time()) + config['tokenLifetime'])
+    else:
+        return httpAuth()
+
 @app.route("/")
 def ui():
-    from datetime import datetime, timedelta
     from flask import render_template
-    from flask import abort
     from flask import request
 
+    # The page is a static shell; its script fetches the history and then polls for new samples
     if config['canAnonViewWebUI'] or authUser(request):
-        dt = datetime.now()
-        twelveHrsAgo = dt - timedelta(hours=12)
-        temperaturearray, humidityarray, timearray = getDataFromDB(int(time.mktime(twelveHrsAgo.timetuple())))
-        return render_template('index.html', temperature=lastTemperature, humidity=lastHumidity, temperaturearray=temperaturearray, humidityarray=humidityarray, timearray=timearray)
+        return render_template('index.html')
     else:
         return httpAuth()
 
 @app.route("/api/v1/temperature")
+@conditional('sample')
 def temperature():
     from flask import request
     if config['canAnonUsePublicAPI'] or authUser(request):
-        return str(lastTemperature)
+        return str(getEnclosure(request).lastTemperature)
     else:
         return httpAuth()
 
 @app.route("/api/v1/humidity")
+@conditional('sample')
 def humidity():
     from flask import request
     if config['canAnonUsePublicAPI'] or authUser(request):
-        return str(lastHumidity)
+        return str(getEnclosure(request).lastHumidity)
     else:
         return httpAuth()
 
 @app.route("/api/v1/settings/temperaturethreshold", methods=['GET', 'POST'])
+@conditional('config')
 def tempthreshold():
     from flask import jsonify, request
 
     if request.method == 'POST':
         if authUserAsAdmin(request.headers):
+            settings, setting = getThresholdSettings(request)
             if request.values.get('alertTemperatureThreshold') is not None:
-                config['alertTemperatureThreshold'] = int(request.values.get('alertTemperatureThreshold'))
+                settings['alertTemperatureThreshold'] = int(request.values.get('alertTemperatureThreshold'))
             if request.values.get('alertTemperatureAboveThreshold') is not None:
-                config['alertTemperatureAboveThreshold'] = int(request.values.get('alertTemperatureAboveThreshold'))
+                settings['alertTemperatureAboveThreshold'] = int(request.values.get('alertTemperatureAboveThreshold'))
             if request.values.get('turnOnTemperatureThreshold') is not None:
-                config['turnOnTemperatureThreshold'] = int(request.values.get('turnOnTemperatureThreshold'))
+                settings['turnOnTemperatureThreshold'] = int(request.values.get('turnOnTemperatureThreshold'))
             if request.values.get('turnOffTemperatureThreshold') is not None:
-                config['turnOffTemperatureThreshold'] = int(request.values.get('turnOffTemperatureThreshold'))
+                settings['turnOffTemperatureThreshold'] = int(request.values.get('turnOffTemperatureThreshold'))
             saveConfig()
             return "Success"
         else:
             return "Authentication Failed"
     else:
         if config['canAnonUsePublicAPI'] or authUser(request):
-            return jsonify(alertTemperatureThreshold=config['alertTemperatureThreshold'], alertTemperatureAboveThreshold=config['alertTemperatureAboveThreshold'], turnOnTemperatureThreshold=config['turnOnTemperatureThreshold'], turnOffTemperatureThreshold=config['turnOffTemperatureThreshold'])
+            settings, setting = getThresholdSettings(request)
+            return jsonify(alertTemperatureThreshold=setting('alertTemperatureThreshold'), alertTemperatureAboveThreshold=setting('alertTemperatureAboveThreshold'), turnOnTemperatureThreshold=setting('turnOnTemperatureThreshold'), turnOffTemperatureThreshold=setting('turnOffTemperatureThreshold'))
         else:
             return httpAuth()
 
 @app.route("/api/v1/settings/humiditythreshold", methods=['GET', 'POST'])
+@conditional('config')
 def humiditythreshold():
     from flask import jsonify, request
 
     if request.method == 'POST':
         if authUserAsAdmin(request.headers):
+            settings, setting = getThresholdSettings(request)
             if request.values.get('alertHumidityThreshold') is not None:
-                config['alertHumidityThreshold'] = int(request.values.get('alertHumidityThreshold'))
+                settings['alertHumidityThreshold'] = int(request.values.get('alertHumidityThreshold'))
             if request.values.get('turnOnHumidityThreshold') is not None:
-                config['turnOnHumidityThreshold'] = int(request.values.get('turnOnHumidityThreshold'))
+                settings['turnOnHumidityThreshold'] = int(request.values.get('turnOnHumidityThreshold'))
             saveConfig()
             return "Success"
         else:
             return "Authentication failed, or user is not an administrator"
     else:
         if config['canAnonUsePublicAPI'] or authUser(request):
-            return jsonify(alertHumidityThreshold=config['alertHumidityThreshold'], turnOnHumidityThreshold=config['turnOnHumidityThreshold'])
+            settings, setting = getThresholdSettings(request)
+            return jsonify(alertHumidityThreshold=setting('alertHumidityThreshold'), turnOnHumidityThreshold=setting('turnOnHumidityThreshold'))
         else:
             return httpAuth()
 
 @app.route('/api/v1/database/<since>')
+@conditional('sample', vary=True, history=True)
 def sendDatabase(since):
     from flask import request
 
+    if canViewHistory(request, since):
+        from flask import abort, jsonify, Response
+
+        since = int(since)
+        enclosure = getEnclosure(request)
+        resolution = request.args.get('resolution', pickResolution(since))
+        if resolution != 'raw' and resolution not in rollupTables:
+            abort(400)
+        format = getHistoryFormat(request)
+        if format in ('ndjson', 'csv'):
+            mimetype = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}[format]
+            from itertools import chain, islice
+            rows = iterDataFromDB(since, resolution, enclosure.id)
+            # Read the first page now, so a busy reader pool gets a 503 instead of a truncated export
+            first = list(islice(rows, 1))
+            return Response(streamData(chain(first, rows), format), mimetype=mimetype)
+        elif format not in ('json', 'columns'):
+            abort(400)
+        temperaturearray, humidityarray, timearray = getDataFromDB(since, False, resolution, enclosure)
+        if format == 'columns':
+            # Rollup averages have one decimal place, raw samples are whole numbers
+            scale = 1 if resolution == 'raw' else 10
+            payload = columnar.encode(timearray, temperaturearray, humidityarray, scale)
+            headers = {}
+            if 'deflate' in request.accept_encodings:
+                import zlib
+                payload = zlib.compress(payload)
+                headers['Content-Encoding'] = 'deflate'
+            return Response(payload, mimetype=columnar.MIMETYPE, headers=headers)
+        return jsonify(temperature=temperaturearray, humidity=humidityarray, time=timearray, resolution=resolution)
+    else:
+        return httpAuth()
+
+@app.route('/api/v1/stream')
+def stream():
+    from flask import request, Response
+
+    if config['canAnonUsePublicAPI'] or authUser(request):
+        # New subscribers start with the current state of every enclosure, then get every change as it is published
+        initial = []
+        for enclosure in enclosures.values():
+            initial += [
+                events.format('sample', {'enclosure': enclosure.id, 'time': enclosure.lastSampleTime, 'temperature': enclosure.lastTemperature, 'humidity': enclosure.lastHumidity}),
+                events.format('heat', {'enclosure': enclosure.id, 'on': enclosure.heater.on}),
+                events.format('pump', {'enclosure': enclosure.id, 'on': bool(enclosure.pump.on)}),
+                events.format('alert', {'enclosure': enclosure.id, 'active': enclosure.alertActive})
+            ]
+        subscription = events.subscribe(initial)
+        if subscription is None:
+            return Response('Too many stream clients', 503)
+        detach = request.environ.get('snakeserver.detach')
+        if detach is not None:
+            # The pooled server hands the socket to the broadcaster once the headers are sent,
+            # so an open stream doesn't hold a worker; the empty iterable keeps Content-Length off
+            detach(partial(events.attach, subscription))
+            return Response(iter(()), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+        return Response(events.stream(subscription), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+    else:
+        return httpAuth()
+
+@app.route('/api/v1/enclosures')
+def listEnclosures():
+    from flask import jsonify, request
+
     if config['canAnonUsePublicAPI'] or authUser(request):
-        from flask import jsonify
+        return jsonify(enclosures=[enclosure.state() for enclosure in enclosures.values()])
+    else:
+        return httpAuth()
+
+@app.route('/api/v1/profiler/start', methods=['POST'])
+def startProfiler():
+    from flask import abort, jsonify, request, Response
+
+    if authUserAsAdmin(request.headers):
+        # Samples every thread for up to ten minutes. Starting again discards the last result
+        try:
+            seconds = min(float(request.values.get('seconds', 30)), 600)
+            interval = max(float(request.values.get('interval', 0.01)), 0.001)
+        except ValueError:
+            abort(400)
+        if not stackProfiler.start(seconds, interval):
+            return Response('Profiler already running', 409)
+        return jsonify(running=True, seconds=seconds, interval=interval)
+    else:
+        return httpAuth()
+
+@app.route('/api/v1/profiler/stop', methods=['POST'])
+def stopProfiler():
+    from flask import request, Response
 
-        temperaturearray, humidityarray, timearray = getDataFromDB(int(since), False)
-        return jsonify(temperature=temperaturearray, humidity=humidityarray, time=timearray)
+    if authUserAsAdmin(request.headers):
+        stackProfiler.stop()
+        return Response(stackProfiler.result(), mimetype='text/plain', headers={'X-Profiler-Samples': str(stackProfiler.samples)})
+    else:
+        return httpAuth()
+
+@app.route('/api/v1/profiler/result')
+def profilerResult():
+    from flask import request, Response
+
+    if authUserAsAdmin(request.headers):
+        # Folded stacks, one "thread;outer;...;inner count" line per stack, ready for flamegraph.pl
+        headers = {
+            'X-Profiler-Running': str(stackProfiler.running).lower(),
+            'X-Profiler-Samples': str(stackProfiler.samples)
+        }
+        return Response(stackProfiler.result(), mimetype='text/plain', headers=headers)
     else:
         return httpAuth()
 
@@ -337,85 +919,85 @@ def updateUsr():
         return httpAuth()
 
 def updateScreen(humidity, temperature, alert):
-    with screenLock:
-        lcd.clear()
-        lcd.message("Temperature: {}\337F\nHumidity: {}%".format(temperature, humidity))
-
-def alertThread():
-    global alertRunning
-    if alertRunning:
-        return None
-    else:
-        alertRunning = True
-    while lastTemperature >= config['alertTemperatureAboveThreshold'] or lastTemperature <= config['alertTemperatureThreshold'] or lastHumidity <= config['alertHumidityThreshold']:
-        with screenLock:
-            lcd.setCursor(14, 1)
-            lcd.message("!!")
-        time.sleep(3)
-        with screenLock:
-            lcd.setCursor(14, 1)
-            lcd.message("  ")
-        time.sleep(3)
-    alertRunning = False
+    display.showReadings(temperature, humidity)
+    display.setAlert(alert)
 
 ## Use main to init and this as a work loop
 def loop():
-    time.sleep(2)
-    lastHumidity, lastTemperature = getDhtData()
+    if sampler.lastPeriod is not None:
+        loopPeriodSeconds.observe(sampler.lastPeriod)
+    loopLatenessSeconds.observe(sampler.lastLateness)
+
+    # The sensors are read one after another, and each read waits for its message to finish,
+    # so only one DHT22 at a time is ever sending edges to the pigpio callbacks
+    readings = [(enclosure, getDhtData(enclosure)) for enclosure in enclosures.values()]
+    for enclosure, reading in readings:
+        # Leave an enclosure as it is rather than act on an old reading
+        if reading is not None:
+            controlEnclosure(enclosure)
+
+    # The LCD shows the first enclosure, and the alert marker if any enclosure is alerting
+    first, reading = readings[0]
+    if reading is not None:
+        updateScreen(first.lastHumidity, first.lastTemperature, any(enclosure.alertActive for enclosure in enclosures.values()))
 
-    alert = lastTemperature >= config['alertTemperatureAboveThreshold'] or lastTemperature <= config['alertTemperatureThreshold'] or lastHumidity <= config['alertHumidityThreshold']
-    updateScreen(lastHumidity, lastTemperature, alert)
-    if alert:
-        thread.start_new_thread(alertThread,())
+def controlEnclosure(enclosure):
+    lastHumidity, lastTemperature = enclosure.lastHumidity, enclosure.lastTemperature
+    events.publish('sample', {'enclosure': enclosure.id, 'time': enclosure.lastSampleTime, 'temperature': lastTemperature, 'humidity': lastHumidity})
 
-    if lastTemperature >= config['alertTemperatureAboveThreshold']:
+    alert = lastTemperature >= enclosure.setting('alertTemperatureAboveThreshold') or lastTemperature <= enclosure.setting('alertTemperatureThreshold') or lastHumidity <= enclosure.setting('alertHumidityThreshold')
+    if alert != enclosure.alertActive:
+        enclosure.alertActive = alert
+        events.publish('alert', {'enclosure': enclosure.id, 'active': alert})
+
+    if lastTemperature >= enclosure.setting('alertTemperatureAboveThreshold'):
         if lastTemperature is not 0:
-            sendAlert("Temperature is too high at {}".format(lastTemperature), "temperature")
-        turnOffHeat()
-    elif lastTemperature <= config['alertTemperatureThreshold']:
+            sendAlert(enclosure, "Temperature is too high at {}".format(lastTemperature), "temperature")
+        enclosure.heater.set(False)
+    elif lastTemperature <= enclosure.setting('alertTemperatureThreshold'):
         if lastTemperature is not 0:
-            sendAlert("Temperature is too low at {}".format(lastTemperature), "temperature")
-        turnOnHeat()
-    elif lastTemperature <= config['turnOnTemperatureThreshold']:
-        turnOnHeat()
-    elif lastTemperature >= config['turnOffTemperatureThreshold']:
-        turnOffHeat()
-
-    if lastHumidity <= config['alertHumidityThreshold']:
+            sendAlert(enclosure, "Temperature is too low at {}".format(lastTemperature), "temperature")
+        enclosure.heater.set(True)
+    elif lastTemperature <= enclosure.setting('turnOnTemperatureThreshold'):
+        enclosure.heater.set(True)
+    elif lastTemperature >= enclosure.setting('turnOffTemperatureThreshold'):
+        enclosure.heater.set(False)
+
+    if lastHumidity <= enclosure.setting('alertHumidityThreshold'):
         if lastHumidity is not 0:
-            sendAlert("Humidity too low at {}".format(lastHumidity), "humidity")
-        runPump(6)
-    elif lastHumidity <= config['turnOnHumidityThreshold']:
-        runPump(3)
-    time.sleep(5)
+            sendAlert(enclosure, "Humidity too low at {}".format(lastHumidity), "humidity")
+        enclosure.pump.pulse(6 / timeScale)
+    elif lastHumidity <= enclosure.setting('turnOnHumidityThreshold'):
+        enclosure.pump.pulse(3 / timeScale)
 
 def flaskThread():
-    with screenLock:
-        lcd.clear()
-        lcd.message("Server Loaded")
-    app.run(port=80, host='0.0.0.0', threaded=True)
-
-def sendAlert(message, type):
-    from pyfcm import FCMNotification
-    import os
-
-    global lastHumidityTime
-    global lastTemperatureTime
-
-    push_service = FCMNotification(api_key=os.environ['FCM_KEY'])
-    if type is "humidity" and lastHumidityTime + 300000 < int(round(time.time() * 1000)):
-        print("Sending humidity Alert")
-        lastHumidityTime = int(round(time.time() * 1000))
-        push_service.notify_topic_subscribers(topic_name="alerts", message_body=message)
-    if type is "temperature" and lastTemperatureTime + 300000 < int(round(time.time() * 1000)):
-        print("Sending temperature Alert")
-        lastTemperatureTime = int(round(time.time() * 1000))
-        push_service.notify_topic_subscribers(topic_name="alerts", message_body=message)
+    display.showStatus(["Server Loaded"])
+    # SNAKE_PORT overrides the configured port without saving it, e.g. for a simulated server
+    port = int(os.environ.get('SNAKE_PORT', config['serverPort']))
+    if config['serverMode'] == 'pool':
+        import server
+        server.PooledWSGIServer(config['serverHost'], port, app, config['serverThreads'], config['serverBacklog'], config['serverKeepAlive'], config['serverRequestTimeout']).serve_forever()
+    else:
+        app.run(port=port, host=config['serverHost'], threaded=True)
+
+def sendAlert(enclosure, message, type):
+    if len(enclosures) > 1:
+        message = "{}: {}".format(enclosure.name, message)
+    # Delivery happens on the dispatcher's thread. Each enclosure sends at most one alert
+    # of each type per alertWindow seconds
+    if alertDispatcher.send((enclosure.id, type), message):
+        print("Sending {} Alert for {}".format(type, enclosure.name))
 
 def saveConfig():
     from json import dump
     import os.path
 
+    global configGeneration
+    global lastConfigTime
+
+    configGeneration += 1
+    lastConfigTime = time.time()
+
     with open('{}/config.json'.format(os.path.dirname(os.path.realpath(__file__))), 'w') as f:
         dump(config, f)
 
@@ -423,56 +1005,110 @@ def readConfig():
     from json import load
     import os.path
 
-    global config
-
+    # Merge over the defaults so settings added since the file was written still exist
     with open('{}/config.json'.format(os.path.dirname(os.path.realpath(__file__))), 'r') as f:
-        config = load(f)
+        config.update(load(f))
 
 def sha256(string):
     import hashlib
     return hashlib.sha256(string.encode('utf-8')).hexdigest()
 
+## Stored passwords are PBKDF2 over the hex sha256 digest, as pbkdf2_sha256$iterations$salt$hash
+def hashPassword(digest):
+    import binascii
+    import hashlib
+
+    salt = binascii.hexlify(os.urandom(16))
+    iterations = config['passwordHashIterations']
+    hashed = hashlib.pbkdf2_hmac('sha256', digest.lower().encode('utf-8'), salt, iterations)
+    return 'pbkdf2_sha256${}${}${}'.format(iterations, salt.decode('ascii'), binascii.hexlify(hashed).decode('ascii'))
+
+def verifyPassword(digest, stored):
+    import binascii
+    import hashlib
+    import hmac
+
+    if not stored.startswith('pbkdf2_sha256$'):
+        return hmac.compare_digest(stored.lower().encode('utf-8'), digest.lower().encode('utf-8'))
+    algorithm, iterations, salt, expected = stored.split('$')
+    hashed = hashlib.pbkdf2_hmac('sha256', digest.lower().encode('utf-8'), salt.encode('ascii'), int(iterations))
+    return hmac.compare_digest(binascii.hexlify(hashed), expected.encode('ascii'))
+
 ## Main
 if __name__ == "__main__":
+    import actuators
+    import alerts
     import atexit
+    import broadcast
     import DHT22
+    from enclosure import Enclosure
     import os.path
     import pigpio
+    import ringbuffer
+    import scheduler
+    import signal
     import sqlite3
+    import sys
+    import ttlcache
 
-    global alertRunning
     global db
     global conn
-    global finishedInit
+    global readerPool
+    global credentialCache
+    global events
+    global alertDispatcher
     global gpio
-    global sensor
-    global lastHumidity
-    global lastTemperature
-
-    lastHumidity = 0
-    lastTemperature = 0
+    global sampler
 
     gpio = pigpio.pi()
     if not gpio.connected:
         exit()
-    sensor = DHT22.sensor(gpio, 15)
     if not os.path.exists('{}/config.json'.format(os.path.dirname(os.path.realpath(__file__)))):
         saveConfig()
     else:
         readConfig()
 
-    db = sqlite3.connect('{}/data.db'.format(os.path.dirname(os.path.realpath(__file__))), check_same_thread = False)
+    # One writer connection, used under databaseLock, and a pool of read-only connections for everything else
+    dbPath = os.environ.get('SNAKE_DATABASE') or '{}/data.db'.format(os.path.dirname(os.path.realpath(__file__)))
+    db = sqlite3.connect(dbPath, check_same_thread = False)
     conn = db.cursor()
-    conn.execute("CREATE TABLE IF NOT EXISTS users (username text, password text, admin int);")
-    conn.execute("CREATE TABLE IF NOT EXISTS data (timestamp int, temperature int, humidity int);")
+    migrateDatabase()
+    conn.execute("SELECT max(rowid) FROM data")
+    lastSampleId = conn.fetchone()[0] or 0
+    readerPool = dbpool.ReaderPool(dbPath, config['databaseReaders'], config['databaseReaderTimeout'])
+    for settings in config['enclosures']:
+        if os.environ.get('SNAKE_SIMULATE'):
+            gpio.addDHT22(settings['sensorGpio'], settings['heatGpio'], settings['pumpGpio'])
+        enclosure = Enclosure(settings, config, DHT22.sensor(gpio, settings['sensorGpio']), ringbuffer.SampleRing(config['recentSampleCapacity']))
+        enclosure.heater = actuators.Actuator(gpio, settings['heatGpio'], 'heat', partial(actuatorChanged, enclosure))
+        enclosure.pump = actuators.Pump(gpio, settings['pumpGpio'], 'pump', enclosure.setting('pumpCooldown') / timeScale, partial(actuatorChanged, enclosure))
+        enclosures[enclosure.id] = enclosure
+        loadRecentSamples(enclosure)
+    credentialCache = ttlcache.TTLCache(config['credentialCacheSize'], config['credentialCacheSeconds'])
+    events = broadcast.Broadcaster(config['maxStreamClients'])
+    # Alerts go to FCM unless alertUrl points them somewhere else, such as a test server
+    if config['alertUrl']:
+        transport = alerts.HTTPTransport(config['alertUrl'])
+    else:
+        transport = alerts.FCMTransport(os.environ.get('FCM_KEY'))
+    alertDispatcher = alerts.AlertDispatcher(transport, config['alertWindow'], config['alertRetries'])
+    alertDispatcher.start()
 
-    alertRunning = False
     finishedInit = True
-    gpio.set_mode(10, pigpio.OUTPUT)
-    gpio.set_mode(11, pigpio.OUTPUT)
-    lastHumidity, lastTemperature = getDhtData()
+    for enclosure in enclosures.values():
+        gpio.set_mode(enclosure.settings['pumpGpio'], pigpio.OUTPUT)
+        gpio.set_mode(enclosure.settings['heatGpio'], pigpio.OUTPUT)
+        getDhtData(enclosure)
     atexit.register(exit_handler)
-    thread.start_new_thread(flaskThread,())
-    time.sleep(2)
-    while True:
-        loop()
+    # systemd stops the service with SIGTERM; exit normally so exit_handler flushes buffered samples
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    # Sample on a fixed grid, never faster than the DHT22 can cope with. A simulated
+    # sensor copes with anything, but the driver needs a gap of over 250ms to see a new reading.
+    # It is made before the web server starts, since /metrics reads its lateness counters
+    sampler = scheduler.PeriodicScheduler(max(max(config['samplePeriod'], DHT22.sensor.MIN_INTERVAL) / timeScale, 0.5))
+    webServer = threading.Thread(target=flaskThread, name='flask')
+    webServer.daemon = True
+    webServer.start()
+    # The control loop runs on the main thread
+    threading.current_thread().name = 'control'
+    sampler.run(loop)
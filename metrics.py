@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+
+"""
+In-memory counters, gauges and histograms, rendered in the
+Prometheus text exposition format.
+
+Each metric may have labels; every distinct set of label values gets
+its own child with its own small lock, so updating a metric never
+contends with other metrics or with a scrape of them.  Metrics whose
+values already live elsewhere, such as the DHT22 error counts, can
+instead be given a collect function that is only called when the
+metrics are rendered.
+"""
+
+import threading
+from bisect import bisect_left
+
+try:
+    from time import monotonic
+except ImportError:
+    from monotonic import monotonic
+
+# Seconds, for anything from a GPIO write to a slow database commit
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+def _formatValue(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+def _formatLabels(pairs):
+    if len(pairs) == 0:
+        return ''
+    escaped = []
+    for name, value in pairs:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        escaped.append('{}="{}"'.format(name, value))
+    return '{' + ','.join(escaped) + '}'
+
+class _Value:
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def set(self, value):
+        self.value = value
+
+class _HistogramValue:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def time(self):
+        """Return a context manager that observes how long its block took."""
+        return _Timer(self)
+
+class _Timer:
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = monotonic()
+        return self
+
+    def __exit__(self, *exception):
+        self.histogram.observe(monotonic() - self.start)
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, help, labelNames=(), collect=None):
+        self.name = name
+        self.help = help
+        self.labelNames = tuple(labelNames)
+        self.collect = collect
+        self.children = {}
+        self.lock = threading.Lock()
+
+    def labels(self, *values):
+        """Return the child for these label values, creating it the first time."""
+        values = tuple(str(value) for value in values)
+        child = self.children.get(values)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(values, self.newChild())
+        return child
+
+    def items(self):
+        with self.lock:
+            items = list(self.children.items())
+        if self.collect is not None:
+            items += [(tuple(str(value) for value in key), value) for key, value in self.collect().items()]
+        return items
+
+class Counter(Metric):
+    """A value that only goes up.  collect returns {label values: value}."""
+
+    kind = 'counter'
+
+    def newChild(self):
+        return _Value()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def samples(self):
+        for key, child in self.items():
+            value = child.value if isinstance(child, _Value) else child
+            yield '', list(zip(self.labelNames, key)), value
+
+class Gauge(Counter):
+    """A value that can go up and down.  collect returns {label values: value}."""
+
+    kind = 'gauge'
+
+    def set(self, value):
+        self.labels().set(value)
+
+class Histogram(Metric):
+    """Counts observations into cumulative buckets, with their sum and count."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelNames=(), buckets=LATENCY_BUCKETS):
+        Metric.__init__(self, name, help, labelNames)
+        self.buckets = tuple(sorted(buckets))
+
+    def newChild(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+    def samples(self):
+        for key, child in self.items():
+            labels = list(zip(self.labelNames, key))
+            with child.lock:
+                counts = child.counts[:]
+                total = child.sum
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                yield '_bucket', labels + [('le', _formatValue(float(bound)))], cumulative
+            yield '_sum', labels, total
+            yield '_count', labels, cumulative
+
+class Registry:
+    """The set of metrics served together on one endpoint."""
+
+    MIMETYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def __init__(self):
+        self.metrics = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelNames=(), collect=None):
+        return self.add(Counter(name, help, labelNames, collect))
+
+    def gauge(self, name, help, labelNames=(), collect=None):
+        return self.add(Gauge(name, help, labelNames, collect))
+
+    def histogram(self, name, help, labelNames=(), buckets=LATENCY_BUCKETS):
+        return self.add(Histogram(name, help, labelNames, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append('# HELP {} {}'.format(metric.name, metric.help))
+            lines.append('# TYPE {} {}'.format(metric.name, metric.kind))
+            for suffix, labels, value in metric.samples():
+                lines.append('{}{}{} {}'.format(metric.name, suffix, _formatLabels(labels), _formatValue(value)))
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import threading
+import time
+
+class SamplingProfiler:
+    """
+    A statistical profiler covering every thread in the process.
+
+    While it runs, a background thread wakes every interval seconds,
+    takes the stack of every other thread from sys._current_frames()
+    and counts it.  Nothing is hooked into the code being profiled, so
+    it costs one stack walk per thread per sample while running and
+    nothing at all when stopped.  Threads blocked on I/O or locks are
+    sampled too, so the counts show where wall clock time goes.
+
+    result() returns the counts as folded stacks: one line per distinct
+    stack, made of the thread name and then each frame from the
+    outermost in, separated by semicolons, then a space and the number
+    of samples.  flamegraph.pl and speedscope both read this format.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = {}
+        self.labels = {}
+        self.samples = 0
+        self.running = False
+        self.stopping = False
+        self.thread = None
+
+    def start(self, seconds, interval=0.01):
+        """Profile for seconds, discarding the last result; return False if already running."""
+        with self.lock:
+            if self.running:
+                return False
+            self.running = True
+            self.stopping = False
+            self.counts = {}
+            self.samples = 0
+            self.thread = threading.Thread(target=self._run, args=(seconds, interval), name='profiler')
+            self.thread.daemon = True
+            self.thread.start()
+            return True
+
+    def stop(self):
+        """Stop profiling early and wait for the last sample to be counted."""
+        with self.lock:
+            self.stopping = True
+            thread = self.thread
+        if thread is not None:
+            thread.join()
+
+    def _run(self, seconds, interval):
+        me = threading.current_thread().ident
+        deadline = time.time() + seconds
+        while not self.stopping and time.time() < deadline:
+            self.sample(me)
+            time.sleep(interval)
+        with self.lock:
+            self.running = False
+
+    def sample(self, ignore=None):
+        names = dict((thread.ident, thread.name) for thread in threading.enumerate())
+        for ident, frame in sys._current_frames().items():
+            if ident == ignore:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(self.label(frame.f_code))
+                frame = frame.f_back
+            stack.append(names.get(ident, 'thread-{}'.format(ident)))
+            stack.reverse()
+            key = ';'.join(stack)
+            self.counts[key] = self.counts.get(key, 0) + 1
+        self.samples += 1
+
+    def label(self, code):
+        label = self.labels.get(code)
+        if label is None:
+            label = '{}:{}'.format(os.path.basename(code.co_filename), code.co_name)
+            self.labels[code] = label
+        return label
+
+    def result(self):
+        """Return the folded stacks counted so far."""
+        counts = dict(self.counts)
+        return ''.join('{} {}\n'.format(stack, count) for stack, count in sorted(counts.items()))
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+
+import threading
+from array import array
+
+class SampleRing:
+    """
+    A fixed capacity ring of the most recent samples.
+
+    Timestamps, temperatures and humidities are kept in three
+    preallocated arrays rather than a list of tuples, so a day of
+    samples costs a couple of hundred KB and appending never
+    allocates.  Samples must be appended in timestamp order.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.times = array('l', [0]) * capacity
+        self.temperatures = array('h', [0]) * capacity
+        self.humidities = array('h', [0]) * capacity
+        self.start = 0 # Index of the oldest sample.
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def append(self, timestamp, temperature, humidity):
+        """Add a sample, overwriting the oldest one when full."""
+        with self.lock:
+            index = (self.start + self.count) % self.capacity
+            self.times[index] = timestamp
+            self.temperatures[index] = temperature
+            self.humidities[index] = humidity
+            if self.count < self.capacity:
+                self.count += 1
+            else:
+                self.start = (self.start + 1) % self.capacity
+
+    def covers(self, since):
+        """
+        Return whether every sample newer than since is in the ring.
+
+        Until the ring first fills up it holds everything that was
+        ever appended, so it covers any window.
+        """
+        with self.lock:
+            return self.count < self.capacity or self.times[self.start] <= since
+
+    def since(self, since):
+        """Return (times, temperatures, humidities) lists for samples newer than since."""
+        with self.lock:
+            # Binary search for the first sample newer than since
+            low = 0
+            high = self.count
+            while low < high:
+                middle = (low + high) // 2
+                if self.times[(self.start + middle) % self.capacity] > since:
+                    high = middle
+                else:
+                    low = middle + 1
+            first = self.start + low
+            last = self.start + self.count
+            columns = []
+            for column in (self.times, self.temperatures, self.humidities):
+                if last <= self.capacity:
+                    columns.append(column[first:last].tolist())
+                elif first >= self.capacity:
+                    columns.append(column[first - self.capacity:last - self.capacity].tolist())
+                else:
+                    columns.append(column[first:].tolist() + column[:last - self.capacity].tolist())
+            return columns[0], columns[1], columns[2]
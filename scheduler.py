@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+
+import time
+
+try:
+    from time import monotonic
+except ImportError:
+    from monotonic import monotonic
+
+class PeriodicScheduler:
+    """
+    Runs a task at fixed deadlines on a monotonic clock.
+
+    Deadlines are start + n * period, so time spent in the task or
+    oversleeping never pushes later ticks back.  If the task overruns
+    so far that a tick is more than half a period overdue, that tick
+    is skipped rather than run back to back with the one before to
+    catch up.
+
+    How late the last tick started is kept in lastLateness and the
+    worst so far in maxLateness, the number of ticks dropped in
+    skipped, and the time since the previous tick started in
+    lastPeriod.
+    """
+
+    def __init__(self, period, clock=monotonic, sleep=time.sleep):
+        self.period = period
+        self.clock = clock
+        self.sleep = sleep
+        self.running = False
+        self.lastStart = None
+        self.lastPeriod = None
+        self.skipped = 0
+        self.lastLateness = 0.0
+        self.maxLateness = 0.0
+
+    def run(self, task):
+        """Call task every period seconds, starting one period from now, until stop is called."""
+        self.running = True
+        deadline = self.clock() + self.period
+        while self.running:
+            now = self.clock()
+            if now < deadline:
+                self.sleep(deadline - now)
+                now = self.clock()
+            if self.lastStart is not None:
+                self.lastPeriod = now - self.lastStart
+            self.lastStart = now
+            self.record(max(0.0, now - deadline))
+            task()
+            deadline += self.period
+            # Deadlines more than half a period gone are dropped; a run
+            # that is only a little late still happens, just late
+            missed = int((self.clock() - deadline) / self.period + 0.5)
+            if missed > 0:
+                self.skipped += missed
+                deadline += missed * self.period
+
+    def stop(self):
+        """Stop after the current tick."""
+        self.running = False
+
+    def record(self, lateness):
+        self.lastLateness = lateness
+        self.maxLateness = max(self.maxLateness, lateness)
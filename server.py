@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+
+import errno
+import os
+import select
+import socket
+import threading
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+try:
+    from Queue import Queue, Full
+except ImportError:
+    from queue import Queue, Full
+
+try:
+    from time import monotonic
+except ImportError:
+    from monotonic import monotonic
+
+OVERLOADED = (b"HTTP/1.1 503 Service Unavailable\r\n"
+              b"Content-Type: text/plain\r\n"
+              b"Content-Length: 17\r\n"
+              b"Retry-After: 1\r\n"
+              b"Connection: close\r\n"
+              b"\r\n"
+              b"Server overloaded")
+
+# The WSGI environ key under which a request finds PooledConnection.detach
+DETACH = 'snakeserver.detach'
+
+class PooledConnection(WSGIRequestHandler, object):
+    """
+    One client connection, kept across its keep-alive requests.
+
+    Unlike a plain request handler it does not serve the connection
+    when it is created; the server calls serveOne each time a request
+    is waiting, so the same buffered rfile is used for every request.
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def __init__(self, request, client_address, server):
+        self.request = request
+        self.client_address = client_address
+        self.server = server
+        self.timeout = server.requestTimeout
+        self.onDetach = None
+        self.idleSince = monotonic()
+        self.setup()
+
+    def fileno(self):
+        return self.connection.fileno()
+
+    def make_environ(self):
+        environ = WSGIRequestHandler.make_environ(self)
+        environ[DETACH] = self.detach
+        return environ
+
+    def detach(self, callback):
+        """
+        Take the socket away from the server once the current response
+        has been sent: callback(socket) is called instead of the
+        connection being kept alive or closed.  The response must not
+        have a Content-Length, so the client reads it until the socket
+        closes.
+        """
+        self.onDetach = callback
+
+    def serveOne(self):
+        """Serve a single request, returning True if the connection can be kept alive."""
+        self.close_connection = True
+        try:
+            self.handle_one_request()
+        except (socket.error, socket.timeout) as e:
+            self.connection_dropped(e)
+            return False
+        return not self.close_connection and self.onDetach is None
+
+    def buffered(self):
+        """Return True if the rfile already holds the start of another request."""
+        # Python 2's socket._fileobject keeps what it has read ahead in _rbuf
+        buffer = getattr(self.rfile, '_rbuf', None)
+        if buffer is not None:
+            return len(buffer.getvalue()) > 0
+        # Python 3's BufferedReader only reads the socket in peek when its buffer is empty,
+        # and a non-blocking socket makes that read return straight away
+        self.connection.setblocking(False)
+        try:
+            return len(self.rfile.peek(1)) > 0
+        except (IOError, OSError):
+            return False
+        finally:
+            self.connection.settimeout(self.timeout)
+
+class PooledWSGIServer(BaseWSGIServer):
+    """
+    A WSGI server with a fixed number of worker threads.
+
+    Connections are HTTP/1.1 keep-alive, but only hold a worker while
+    a request is being served.  Between requests the connection goes
+    back to the accept loop, which watches every idle connection with
+    select and queues it for a worker as soon as its next request
+    arrives, or closes it after keepAlive seconds without one.  New
+    connections start out idle the same way, so a browser's spare
+    connections never take a worker either.
+
+    Connections with a request ready wait in a queue of at most
+    backlog entries for a free worker.  When the queue is full the
+    connection is answered with a 503 straight away instead of being
+    queued, so a burst of requests can never create more than threads
+    threads.
+
+    While a request is served, the client has requestTimeout seconds
+    to send or accept each piece of data.  A response can hand its
+    socket to someone else with the detach function in its environ,
+    which is how the event stream is served without holding a worker.
+    """
+
+    multithread = True
+
+    def __init__(self, host, port, app, threads=6, backlog=16, keepAlive=5, requestTimeout=60):
+        BaseWSGIServer.__init__(self, host, port, app, PooledConnection)
+        self.keepAlive = keepAlive
+        self.requestTimeout = requestTimeout
+        self.requests = Queue(backlog)
+        self.idle = set()
+        self.lock = threading.Lock()
+        self.wakeReader, self.wakeWriter = os.pipe()
+        self.stopping = False
+        self.stopped = threading.Event()
+        for i in range(threads):
+            worker = threading.Thread(target=self._work, name='http-{}'.format(i))
+            worker.daemon = True
+            worker.start()
+
+    def serve_forever(self, poll_interval=None):
+        try:
+            while not self.stopping:
+                now = monotonic()
+                with self.lock:
+                    idle = list(self.idle)
+                timeout = None
+                if len(idle) > 0:
+                    timeout = max(0, min(connection.idleSince for connection in idle) + self.keepAlive - now)
+                try:
+                    readable = select.select([self.socket, self.wakeReader] + idle, [], [], timeout)[0]
+                except (select.error, OSError) as e:
+                    if e.args[0] == errno.EINTR:
+                        continue
+                    raise
+                for ready in readable:
+                    if ready is self.socket:
+                        self._handle_request_noblock()
+                    elif ready is self.wakeReader:
+                        os.read(self.wakeReader, 512)
+                    else:
+                        with self.lock:
+                            self.idle.discard(ready)
+                        self.dispatch(ready)
+                self.expire(monotonic())
+        finally:
+            self.stopped.set()
+
+    def shutdown(self):
+        self.stopping = True
+        self.wake()
+        self.stopped.wait()
+
+    def wake(self):
+        os.write(self.wakeWriter, b'x')
+
+    def process_request(self, request, client_address):
+        # Responses go out as separate header and body writes, which Nagle would hold
+        # back for the client's delayed ACK, costing ~40ms on every keep-alive request
+        request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        try:
+            connection = PooledConnection(request, client_address, self)
+        except socket.error:
+            self.shutdown_request(request)
+            return
+        self.park(connection)
+
+    def park(self, connection):
+        """Leave a connection with the accept loop until its next request arrives."""
+        connection.idleSince = monotonic()
+        with self.lock:
+            self.idle.add(connection)
+        self.wake()
+
+    def expire(self, now):
+        with self.lock:
+            expired = [connection for connection in self.idle if now - connection.idleSince >= self.keepAlive]
+            self.idle.difference_update(expired)
+        for connection in expired:
+            self.close(connection)
+
+    def dispatch(self, connection):
+        try:
+            self.requests.put_nowait(connection)
+        except Full:
+            try:
+                connection.request.sendall(OVERLOADED)
+            except socket.error:
+                pass
+            self.close(connection)
+
+    def close(self, connection):
+        try:
+            connection.finish()
+        except socket.error:
+            pass
+        self.shutdown_request(connection.request)
+
+    def _work(self):
+        while True:
+            connection = self.requests.get()
+            try:
+                keepAlive = connection.serveOne()
+            except Exception:
+                self.handle_error(connection.request, connection.client_address)
+                keepAlive = False
+            if connection.onDetach is not None:
+                try:
+                    connection.finish()
+                    connection.onDetach(connection.request)
+                except Exception:
+                    self.handle_error(connection.request, connection.client_address)
+                    self.shutdown_request(connection.request)
+            elif not keepAlive:
+                self.close(connection)
+            elif connection.buffered():
+                # A pipelined request is already waiting in the rfile, where select can't see it
+                self.dispatch(connection)
+            else:
+                self.park(connection)
@@ -0,0 +1,433 @@
+#!/usr/bin/env python
+
+"""
+Simulated hardware, so the whole server can run on an ordinary Linux
+box.
+
+install() puts stand-ins for the pigpio and RPi.GPIO modules into
+sys.modules, so it has to be called before DHT22 or lcd1602 are
+imported or an LCD is created.  main.py does this itself when the
+SNAKE_SIMULATE environment variable is set.
+
+- pigpio.pi() returns a FakePi.  GPIO levels and modes are kept in
+  memory, and watchdogs and edge callbacks behave as pigpio's do.
+- FakePi.addDHT22 puts a DHT22Emulator on a GPIO.  When the driver
+  triggers it, the emulator answers with the sensor's real edge
+  timings, in microsecond ticks, straight into the driver's callback.
+  It can be told to fail some reads.  The readings come from an
+  Environment whose temperature and humidity drift towards ambient
+  and rise while the enclosure's heater or pump GPIO is high.
+- RPi.GPIO is an LCDSink, which decodes the HD44780 nibbles the
+  lcd1602 driver writes and records each frame it displays.
+
+The environment runs timeScale times faster than the wall clock, so
+heating and humidity change at a pace that matches a correspondingly
+shorter sample period.
+
+Settings come from the environment:
+SNAKE_TIME_SCALE   how much faster than real time to run (default 1)
+SNAKE_SIMULATE_ERRORS   failure rates per read, e.g.
+                        "checksum=0.02,short=0.01,missing=0.01"
+"""
+
+import math
+import os
+import random
+import sys
+import threading
+import time
+import types
+from collections import deque
+
+# pigpio constants used by the DHT22 driver and main.py
+INPUT = 0
+OUTPUT = 1
+LOW = 0
+HIGH = 1
+PUD_OFF = 0
+PUD_DOWN = 1
+PUD_UP = 2
+RISING_EDGE = 0
+FALLING_EDGE = 1
+EITHER_EDGE = 2
+TIMEOUT = 2
+
+timeScale = 1.0
+errorRates = {}
+# The LCDSink behind RPi.GPIO once install() has been called
+lcd = None
+
+def tickDiff(start, end):
+    return (end - start) & 0xffffffff
+
+class _Callback:
+    def __init__(self, pi, gpio, edge, function):
+        self.pi = pi
+        self.gpio = gpio
+        self.edge = edge
+        self.function = function
+
+    def cancel(self):
+        self.pi.removeCallback(self)
+
+class FakePi:
+    """
+    A stand-in for pigpio.pi.
+
+    Callbacks get (gpio, level, tick) for every level change, and a
+    TIMEOUT level when a watchdog expires without one, like pigpio's.
+    Ticks are microseconds of wall clock time, wrapping at 32 bits.
+    """
+
+    def __init__(self, host=None, port=None):
+        self.connected = True
+        self.levels = {}
+        self.modes = {}
+        self.callbacks = []
+        self.watchdogs = {}
+        self.lastEdges = {}
+        self.sensors = {}
+        self.lock = threading.RLock()
+
+    def get_current_tick(self):
+        return int(time.time() * 1000000) & 0xffffffff
+
+    def addDHT22(self, gpio, heatGpio=None, pumpGpio=None):
+        """Connect an emulated DHT22 to gpio, in an enclosure heated and misted through the other two."""
+        environment = Environment(self, heatGpio, pumpGpio)
+        self.sensors[gpio] = DHT22Emulator(self, gpio, environment, errorRates)
+        return self.sensors[gpio]
+
+    def read(self, gpio):
+        return self.levels.get(gpio, LOW)
+
+    def write(self, gpio, level):
+        self.modes[gpio] = OUTPUT
+        self.setLevel(gpio, level, self.get_current_tick())
+
+    def set_mode(self, gpio, mode):
+        self.modes[gpio] = mode
+        if mode == INPUT and gpio in self.sensors:
+            # The pull-up raises the line, then the sensor answers
+            tick = self.get_current_tick()
+            self.setLevel(gpio, HIGH, tick)
+            self.sensors[gpio].respond(tick)
+
+    def get_mode(self, gpio):
+        return self.modes.get(gpio, INPUT)
+
+    def set_pull_up_down(self, gpio, pud):
+        pass
+
+    def set_watchdog(self, gpio, timeout):
+        with self.lock:
+            timer = self.watchdogs.pop(gpio, None)
+            if timer is not None:
+                timer.cancel()
+            if timeout > 0:
+                self.startWatchdog(gpio, timeout / 1000.0)
+
+    def startWatchdog(self, gpio, seconds):
+        timer = threading.Timer(seconds, self.watchdogExpired, (gpio, seconds))
+        timer.daemon = True
+        self.watchdogs[gpio] = timer
+        timer.start()
+
+    def watchdogExpired(self, gpio, seconds):
+        with self.lock:
+            if gpio not in self.watchdogs:
+                return
+            idle = time.time() - self.lastEdges.get(gpio, 0)
+            if idle < seconds:
+                self.startWatchdog(gpio, seconds - idle)
+                return
+            # pigpio keeps sending timeouts until the watchdog is cancelled
+            self.startWatchdog(gpio, seconds)
+        self.notify(gpio, TIMEOUT, self.get_current_tick())
+
+    def callback(self, gpio, edge=RISING_EDGE, func=None):
+        callback = _Callback(self, gpio, edge, func)
+        with self.lock:
+            self.callbacks.append(callback)
+        return callback
+
+    def removeCallback(self, callback):
+        with self.lock:
+            if callback in self.callbacks:
+                self.callbacks.remove(callback)
+
+    def setLevel(self, gpio, level, tick):
+        with self.lock:
+            if self.levels.get(gpio) == level:
+                return
+            self.levels[gpio] = level
+            self.lastEdges[gpio] = time.time()
+        self.notify(gpio, level, tick)
+
+    def notify(self, gpio, level, tick):
+        with self.lock:
+            callbacks = [callback for callback in self.callbacks if callback.gpio == gpio]
+        for callback in callbacks:
+            if level == TIMEOUT or callback.edge == EITHER_EDGE or callback.edge == (FALLING_EDGE if level == LOW else RISING_EDGE):
+                callback.function(gpio, level, tick)
+
+    def stop(self):
+        with self.lock:
+            for timer in self.watchdogs.values():
+                timer.cancel()
+            self.watchdogs.clear()
+        self.connected = False
+
+class Environment:
+    """
+    A rough model of the air in an enclosure.
+
+    Temperature relaxes towards ambient, or towards ambient plus
+    heaterGain while the heater GPIO is high, over timeConstant
+    seconds.  Humidity relaxes towards ambient the same way and rises
+    by pumpRate percent for every second the pump GPIO was high.
+    """
+
+    def __init__(self, pi, heatGpio=None, pumpGpio=None, temperature=27.0, humidity=72.0,
+                 ambientTemperature=24.0, ambientHumidity=55.0, heaterGain=12.0, pumpRate=1.5, timeConstant=900.0):
+        self.pi = pi
+        self.heatGpio = heatGpio
+        self.temperature = temperature
+        self.humidity = humidity
+        self.ambientTemperature = ambientTemperature
+        self.ambientHumidity = ambientHumidity
+        self.heaterGain = heaterGain
+        self.pumpRate = pumpRate
+        self.timeConstant = timeConstant
+        self.updated = time.time()
+        # Pump pulses are shorter than a sample period, so their length is added up as they happen
+        self.pumpStarted = None
+        self.pumped = 0.0
+        if pumpGpio is not None:
+            pi.callback(pumpGpio, EITHER_EDGE, self.pumpChanged)
+
+    def pumpChanged(self, gpio, level, tick):
+        now = time.time()
+        if level == HIGH:
+            self.pumpStarted = now
+        elif level == LOW and self.pumpStarted is not None:
+            self.pumped += (now - self.pumpStarted) * timeScale
+            self.pumpStarted = None
+
+    def read(self):
+        """Advance the model to now and return (temperature, humidity)."""
+        now = time.time()
+        elapsed = (now - self.updated) * timeScale
+        self.updated = now
+        decay = 1 - math.exp(-elapsed / self.timeConstant)
+        target = self.ambientTemperature
+        if self.heatGpio is not None and self.pi.read(self.heatGpio):
+            target += self.heaterGain
+        self.temperature += (target - self.temperature) * decay
+        pumped, self.pumped = self.pumped, 0.0
+        if self.pumpStarted is not None:
+            pumped += (now - self.pumpStarted) * timeScale
+            self.pumpStarted = now
+        self.humidity += (self.ambientHumidity - self.humidity) * decay + self.pumpRate * pumped
+        self.humidity = min(max(self.humidity, 0.0), 99.9)
+        return self.temperature + random.gauss(0, 0.05), self.humidity + random.gauss(0, 0.2)
+
+class DHT22Emulator:
+    """
+    Answers triggers on a FakePi GPIO the way a DHT22 does.
+
+    A response is an 80us low and 80us high preamble, then 40 bits,
+    each a ~50us low followed by a high of ~26us for a 0 or ~70us
+    for a 1, then the line is released.  The bits are humidity and
+    temperature in tenths, most significant byte first, and a checksum.
+
+    errorRates gives the chance per read of a "missing" response (no
+    answer at all), a "short" one (cut off part way through) and a
+    "checksum" one (a corrupted bit).  The driver's watchdog deals
+    with the first two.
+    """
+
+    def __init__(self, pi, gpio, environment, errorRates=None):
+        self.pi = pi
+        self.gpio = gpio
+        self.environment = environment
+        self.errorRates = errorRates or {}
+        self.responses = 0
+
+    def respond(self, tick):
+        """Answer a trigger whose release of the line was at tick."""
+        temperature, humidity = self.environment.read()
+        thread = threading.Thread(target=self.send, args=(tick, temperature, humidity), name='dht22-{}'.format(self.gpio))
+        thread.daemon = True
+        thread.start()
+
+    def frame(self, temperature, humidity):
+        humidity = int(round(humidity * 10))
+        temperature = int(round(abs(temperature) * 10)) | (0x8000 if temperature < 0 else 0)
+        data = [humidity >> 8, humidity & 255, temperature >> 8, temperature & 255]
+        data.append(sum(data) & 255)
+        return [(byte >> (7 - i)) & 1 for byte in data for i in range(8)]
+
+    def send(self, tick, temperature, humidity):
+        self.responses += 1
+        bits = self.frame(temperature, humidity)
+        chance = random.random()
+        for kind in ('missing', 'short', 'checksum'):
+            rate = self.errorRates.get(kind, 0)
+            if chance < rate:
+                break
+            chance -= rate
+        else:
+            kind = None
+        if kind == 'missing':
+            return
+        if kind == 'short':
+            bits = bits[:random.randint(8, 38)]
+        elif kind == 'checksum':
+            bits[random.randint(0, 31)] ^= 1
+
+        edges = [(LOW, 20 + random.randint(0, 20)), (HIGH, 80), (LOW, 80)]
+        for bit in bits:
+            edges.append((HIGH, 50 + random.randint(-4, 4)))
+            edges.append((LOW, (70 if bit else 26) + random.randint(-3, 3)))
+        if kind != 'short':
+            edges.append((HIGH, 50))
+        for level, duration in edges:
+            tick = (tick + duration) & 0xffffffff
+            self.pi.setLevel(self.gpio, level, tick)
+
+class LCDSink:
+    """
+    A stand-in for RPi.GPIO that an HD44780 driver can write to.
+
+    Nibbles are latched on each falling edge of E, assembled into
+    bytes and applied to a model of the display's memory.  A burst of
+    writes that changes the screen is recorded as one frame, a
+    (time, lines) pair, once settle seconds pass without another
+    write; lines() is always what is on screen right now.
+    """
+
+    BCM = 11
+    BOARD = 10
+    OUT = 0
+    IN = 1
+    LOW = 0
+    HIGH = 1
+
+    def __init__(self, pin_rs=27, pin_e=22, pins_db=(25, 24, 23, 18), cols=16, rows=2, maxFrames=1000, settle=0.01):
+        self.pin_rs = pin_rs
+        self.pin_e = pin_e
+        self.pins_db = pins_db
+        self.cols = cols
+        self.rows = rows
+        self.levels = {}
+        self.nibble = None
+        self.address = 0
+        self.memory = [[' '] * cols for row in range(rows)]
+        self.frames = deque(maxlen=maxFrames)
+        self.settle = settle
+        self.dirty = False
+        self.lastWrite = 0
+        self.writes = 0
+        self.lock = threading.Lock()
+
+    def setwarnings(self, flag):
+        pass
+
+    def setmode(self, mode):
+        pass
+
+    def setup(self, channel, direction, initial=None):
+        self.levels[channel] = bool(initial)
+
+    def cleanup(self, channels=None):
+        pass
+
+    def input(self, channel):
+        return int(self.levels.get(channel, False))
+
+    def output(self, channels, values):
+        if not isinstance(channels, (list, tuple)):
+            channels, values = [channels], [values]
+        elif not isinstance(values, (list, tuple)):
+            values = [values] * len(channels)
+        with self.lock:
+            latch = False
+            for channel, value in zip(channels, values):
+                if channel == self.pin_e and self.levels.get(channel) and not value:
+                    latch = True
+                self.levels[channel] = bool(value)
+            if latch:
+                self.latch()
+
+    def latch(self):
+        nibble = sum(self.levels.get(pin, False) << i for i, pin in enumerate(self.pins_db))
+        if self.nibble is None:
+            self.nibble = nibble
+            return
+        byte = self.nibble << 4 | nibble
+        self.nibble = None
+        now = time.time()
+        if self.dirty and now - self.lastWrite > self.settle:
+            self.frames.append((self.lastWrite, self.lines()))
+            self.dirty = False
+        self.lastWrite = now
+        self.writes += 1
+        if self.levels.get(self.pin_rs):
+            self.writeData(byte)
+        else:
+            self.command(byte)
+
+    def command(self, byte):
+        if byte & 0x80:
+            self.address = byte & 0x7f
+        elif byte == 0x01:
+            self.memory = [[' '] * self.cols for row in range(self.rows)]
+            self.address = 0
+            self.dirty = True
+        elif byte & 0xfe == 0x02:
+            self.address = 0
+
+    def writeData(self, byte):
+        row, col = divmod(self.address, 0x40)
+        if row < self.rows and col < self.cols and self.memory[row][col] != chr(byte):
+            self.memory[row][col] = chr(byte)
+            self.dirty = True
+        self.address = (self.address + 1) & 0x7f
+
+    def lines(self):
+        return [''.join(row) for row in self.memory]
+
+def parseErrorRates(text):
+    rates = {}
+    for part in text.split(','):
+        if '=' in part:
+            kind, rate = part.split('=', 1)
+            rates[kind.strip()] = float(rate)
+    return rates
+
+def install():
+    """Replace pigpio and RPi.GPIO with the simulated hardware."""
+    global timeScale
+    global errorRates
+    global lcd
+
+    timeScale = float(os.environ.get('SNAKE_TIME_SCALE', 1))
+    errorRates = parseErrorRates(os.environ.get('SNAKE_SIMULATE_ERRORS', ''))
+
+    pigpio = types.ModuleType('pigpio')
+    for name in ('INPUT', 'OUTPUT', 'LOW', 'HIGH', 'PUD_OFF', 'PUD_DOWN', 'PUD_UP',
+                 'RISING_EDGE', 'FALLING_EDGE', 'EITHER_EDGE', 'TIMEOUT', 'tickDiff'):
+        setattr(pigpio, name, globals()[name])
+    pigpio.pi = FakePi
+    sys.modules['pigpio'] = pigpio
+
+    lcd = LCDSink()
+    RPi = types.ModuleType('RPi')
+    GPIO = types.ModuleType('RPi.GPIO')
+    for name in ('BCM', 'BOARD', 'OUT', 'IN', 'LOW', 'HIGH',
+                 'setwarnings', 'setmode', 'setup', 'cleanup', 'input', 'output'):
+        setattr(GPIO, name, getattr(lcd, name))
+    RPi.GPIO = GPIO
+    sys.modules['RPi'] = RPi
+    sys.modules['RPi.GPIO'] = GPIO
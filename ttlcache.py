@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+
+import threading
+import time
+from collections import OrderedDict
+
+class TTLCache:
+    """
+    A small thread safe cache whose entries expire after ttl seconds.
+
+    At most size entries are kept; when a new one is added the least
+    recently used entry is evicted.
+    """
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached value, or None if it is missing or expired."""
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None or entry[1] < time.time():
+                return None
+            self.entries[key] = entry # Most recently used go last.
+            return entry[0]
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (value, time.time() + self.ttl)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def pop(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()